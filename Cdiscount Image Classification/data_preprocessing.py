@@ -1,5 +1,11 @@
 import os
 import bson
+import mmap
+import shutil
+import struct
+import numpy as np
+from multiprocessing import Pool
+import image_shards
 
 # Dataset
 PROJECT_NAME = "Cdiscount Image Classification"
@@ -11,24 +17,119 @@ EXTRACTED_DATASET_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "extracted")
 TRAIN_FOLDER_PATH = os.path.join(EXTRACTED_DATASET_FOLDER_PATH, "train")
 TEST_FOLDER_PATH = os.path.join(EXTRACTED_DATASET_FOLDER_PATH, "test")
 
-def run():
-    for dataset_file_path, dataset_folder_path in zip((TRAIN_FILE_PATH, TEST_FILE_PATH), (TRAIN_FOLDER_PATH, TEST_FOLDER_PATH)):
-        print("Processing {} ...".format(dataset_file_path))
+# Write the pictures into a few large shard files with an offset index, instead of one JPEG file per picture
+SHARD_MODE = False
+SHARDED_DATASET_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "sharded")
+TRAIN_SHARD_FOLDER_PATH = os.path.join(SHARDED_DATASET_FOLDER_PATH, "train")
+TEST_SHARD_FOLDER_PATH = os.path.join(SHARDED_DATASET_FOLDER_PATH, "test")
+
+# Decode disjoint ranges of documents in worker processes, based on the document offsets found by a pre-scan
+PARALLEL_MODE = False
+PROCESS_NUM = os.cpu_count()
+OFFSET_INDEX_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "offset_index")
+
+def write_pictures(document, dataset_folder_path):
+    category_id = document.get("category_id", "dummy")
+    category_folder_path = os.path.join(dataset_folder_path, str(category_id))
+    os.makedirs(category_folder_path, exist_ok=True)
+
+    product_id = document["_id"]
+    for picture_id, picture_dict in enumerate(document["imgs"]):
+        picture_content = picture_dict["picture"]
+        picture_file_path = os.path.join(category_folder_path, "{}_{}.jpg".format(product_id, picture_id))
+        with open(picture_file_path, "wb") as picture_file_object:
+            picture_file_object.write(picture_content)
+
+def get_file_signature(file_path):
+    file_stat = os.stat(file_path)
+    return [file_stat.st_size, int(file_stat.st_mtime)]
+
+def scan_document_offsets(dataset_file_path):
+    # Each BSON document starts with its length as a little-endian int32, so the scan only touches 4 bytes per document
+    offset_list = []
+    with open(dataset_file_path, "rb") as dataset_file_object:
+        with mmap.mmap(dataset_file_object.fileno(), 0, access=mmap.ACCESS_READ) as dataset_buffer:
+            offset = 0
+            while offset < len(dataset_buffer):
+                # The smallest document is the length and the terminating null byte, and a truncated file would make the scan loop forever
+                length = struct.unpack_from("<i", dataset_buffer, offset)[0] if offset + 4 <= len(dataset_buffer) else 0
+                if length < 5 or offset + length > len(dataset_buffer):
+                    raise ValueError("{} is corrupted at offset {}, the document length is {}!".format(dataset_file_path, offset, length))
+                offset_list.append(offset)
+                offset += length
+    # The last entry is the end of the file, so that the lengths are the differences
+    return np.array(offset_list + [offset], dtype=np.int64)
 
-        with open(dataset_file_path, "rb") as dataset_file_object:
-            data_generator = bson.decode_file_iter(dataset_file_object)
+def load_document_offsets(dataset_file_path):
+    offset_index_file_path = os.path.join(OFFSET_INDEX_FOLDER_PATH, "{}.npz".format(os.path.basename(dataset_file_path)))
+    if os.path.isfile(offset_index_file_path):
+        with np.load(offset_index_file_path) as offset_index_file_object:
+            if offset_index_file_object["signature"].tolist() == get_file_signature(dataset_file_path):
+                print("Loading document offsets from {} ...".format(offset_index_file_path))
+                return offset_index_file_object["offset_array"]
 
-            for data in data_generator:
-                category_id = data.get("category_id", "dummy")
-                category_folder_path = os.path.join(dataset_folder_path, str(category_id))
-                os.makedirs(category_folder_path, exist_ok=True)
+    print("Scanning document offsets of {} ...".format(dataset_file_path))
+    offset_array = scan_document_offsets(dataset_file_path)
+    os.makedirs(OFFSET_INDEX_FOLDER_PATH, exist_ok=True)
+    np.savez(offset_index_file_path, offset_array=offset_array, signature=np.array(get_file_signature(dataset_file_path)))
+    return offset_array
 
-                product_id = data["_id"]
-                for picture_id, picture_dict in enumerate(data["imgs"]):
-                    picture_content = picture_dict["picture"]
-                    picture_file_path = os.path.join(category_folder_path, "{}_{}.jpg".format(product_id, picture_id))
-                    with open(picture_file_path, "wb") as picture_file_object:
-                        picture_file_object.write(picture_content)
+def split_document_ranges(offset_array, range_num):
+    # The ranges are balanced by bytes rather than by documents, since the number of pictures varies
+    boundary_array = np.searchsorted(offset_array[:-1], np.linspace(0, offset_array[-1], range_num + 1)[1:-1])
+    boundary_list = sorted(set([0] + boundary_array.tolist() + [len(offset_array) - 1]))
+    return list(zip(boundary_list[:-1], boundary_list[1:]))
+
+def extract_document_range(job):
+    # Each range is written to its own shard, so that the workers never share a file
+    dataset_file_path, output_folder_path, range_offset_array, range_index = job
+    image_shard_writer = image_shards.ImageShardWriter(output_folder_path, shard_size=np.inf, first_shard_id=range_index) if SHARD_MODE else None
+    with open(dataset_file_path, "rb") as dataset_file_object:
+        with mmap.mmap(dataset_file_object.fileno(), 0, access=mmap.ACCESS_READ) as dataset_buffer:
+            for start_offset, end_offset in zip(range_offset_array[:-1], range_offset_array[1:]):
+                document = bson.BSON(dataset_buffer[start_offset:end_offset]).decode()
+                if image_shard_writer is not None:
+                    image_shard_writer.write_document(document)
+                else:
+                    write_pictures(document, output_folder_path)
+    return image_shard_writer.close() if image_shard_writer is not None else len(range_offset_array) - 1
+
+def extract_in_parallel(dataset_file_path, output_folder_path):
+    offset_array = load_document_offsets(dataset_file_path)
+    range_num = max(PROCESS_NUM, int(np.ceil(offset_array[-1] / image_shards.SHARD_SIZE)))
+    document_range_list = split_document_ranges(offset_array, range_num)
+    print("Decoding {} documents in {} ranges with {} processes ...".format(len(offset_array) - 1, len(document_range_list), PROCESS_NUM))
+
+    working_folder_path = output_folder_path + ".tmp" if SHARD_MODE else output_folder_path
+    if SHARD_MODE:
+        shutil.rmtree(working_folder_path, ignore_errors=True)
+    os.makedirs(working_folder_path, exist_ok=True)
+    job_list = [(dataset_file_path, working_folder_path, offset_array[start_index:end_index + 1], range_index)
+                for range_index, (start_index, end_index) in enumerate(document_range_list)]
+    with Pool(processes=PROCESS_NUM) as pool:
+        # imap keeps the order of the ranges, so the index follows the order of the BSON file
+        result_list = list(pool.imap(extract_document_range, job_list))
+
+    if SHARD_MODE:
+        index_array = np.concatenate(result_list)
+        image_shards.finalize_shards(working_folder_path, output_folder_path, index_array)
+        print("Wrote {} pictures to {} shards.".format(len(index_array), len(document_range_list)))
+    else:
+        print("Wrote the pictures of {} documents.".format(sum(result_list)))
+
+def run():
+    for dataset_file_path, dataset_folder_path, shard_folder_path in zip((TRAIN_FILE_PATH, TEST_FILE_PATH), (TRAIN_FOLDER_PATH, TEST_FOLDER_PATH),
+                                                                         (TRAIN_SHARD_FOLDER_PATH, TEST_SHARD_FOLDER_PATH)):
+        print("Processing {} ...".format(dataset_file_path))
+        if PARALLEL_MODE:
+            extract_in_parallel(dataset_file_path, shard_folder_path if SHARD_MODE else dataset_folder_path)
+        elif SHARD_MODE:
+            index_array = image_shards.convert_bson_file(dataset_file_path, shard_folder_path)
+            print("Wrote {} pictures to {} shards.".format(len(index_array), len(set(index_array["shard_id"].tolist()))))
+        else:
+            with open(dataset_file_path, "rb") as dataset_file_object:
+                for document in bson.decode_file_iter(dataset_file_object):
+                    write_pictures(document, dataset_folder_path)
 
     print("All done!")
 
@@ -0,0 +1,122 @@
+import os
+import cv2
+import bson
+import mmap
+import shutil
+import numpy as np
+
+# Each shard is a large file which contains the JPEG bytes back to back, and the index tells where each picture is
+SHARD_SIZE = 4 * 1024 ** 3
+SHARD_FILE_NAME_TEMPLATE = "shard_{:05d}.bin"
+INDEX_FILE_NAME = "index.npy"
+INDEX_DTYPE = np.dtype([("product_id", np.int64), ("picture_id", np.int16), ("category_id", np.int64),
+                        ("shard_id", np.uint16), ("offset", np.uint64), ("length", np.uint32)])
+DUMMY_CATEGORY_ID = -1
+MAX_PICTURE_NUM = 256  # Used to pack product_id and picture_id into a single key
+
+class ImageShardWriter(object):
+    # Appends pictures to the current shard, and starts a new shard once the current one is full
+
+    def __init__(self, shard_folder_path, shard_size=SHARD_SIZE, first_shard_id=0):
+        self.shard_folder_path = shard_folder_path
+        self.shard_size = shard_size
+        self.shard_id = first_shard_id - 1
+        self.shard_file_object = None
+        self.offset = 0
+        self.index_entry_list = []
+        os.makedirs(shard_folder_path, exist_ok=True)
+
+    def open_next_shard(self):
+        if self.shard_file_object is not None:
+            self.shard_file_object.close()
+        self.shard_id += 1
+        self.shard_file_object = open(os.path.join(self.shard_folder_path, SHARD_FILE_NAME_TEMPLATE.format(self.shard_id)), "wb")
+        self.offset = 0
+
+    def write_document(self, document):
+        category_id = document.get("category_id", DUMMY_CATEGORY_ID)
+        product_id = document["_id"]
+        for picture_id, picture_dict in enumerate(document["imgs"]):
+            picture_content = picture_dict["picture"]
+            if self.shard_file_object is None or (self.offset > 0 and self.offset + len(picture_content) > self.shard_size):
+                self.open_next_shard()
+            self.shard_file_object.write(picture_content)
+            self.index_entry_list.append((product_id, picture_id, category_id, self.shard_id, self.offset, len(picture_content)))
+            self.offset += len(picture_content)
+
+    def close(self):
+        if self.shard_file_object is not None:
+            self.shard_file_object.close()
+            self.shard_file_object = None
+        return np.array(self.index_entry_list, dtype=INDEX_DTYPE)
+
+def finalize_shards(temporary_folder_path, shard_folder_path, index_array):
+    # The index is written last, and the folder is renamed, so that an interrupted conversion is never picked up
+    np.save(os.path.join(temporary_folder_path, INDEX_FILE_NAME), index_array)
+    shutil.rmtree(shard_folder_path, ignore_errors=True)
+    os.replace(temporary_folder_path, shard_folder_path)
+
+def convert_bson_file(dataset_file_path, shard_folder_path, shard_size=SHARD_SIZE):
+    temporary_folder_path = shard_folder_path + ".tmp"
+    shutil.rmtree(temporary_folder_path, ignore_errors=True)
+    image_shard_writer = ImageShardWriter(temporary_folder_path, shard_size)
+    try:
+        with open(dataset_file_path, "rb") as dataset_file_object:
+            for document in bson.decode_file_iter(dataset_file_object):
+                image_shard_writer.write_document(document)
+    finally:
+        index_array = image_shard_writer.close()
+    finalize_shards(temporary_folder_path, shard_folder_path, index_array)
+    return index_array
+
+class ImageShardReader(object):
+    # Memory-maps the shards, so that both random access and sequential access read from the page cache
+
+    def __init__(self, shard_folder_path):
+        self.shard_folder_path = shard_folder_path
+        self.index_array = np.load(os.path.join(shard_folder_path, INDEX_FILE_NAME))
+        self.shard_buffer_dict = {}
+        self.sorted_indexes = None
+        self.sorted_packed_key_array = None
+
+    def __len__(self):
+        return len(self.index_array)
+
+    def get_shard_buffer(self, shard_id):
+        shard_buffer = self.shard_buffer_dict.get(shard_id)
+        if shard_buffer is None:
+            with open(os.path.join(self.shard_folder_path, SHARD_FILE_NAME_TEMPLATE.format(shard_id)), "rb") as shard_file_object:
+                shard_buffer = mmap.mmap(shard_file_object.fileno(), 0, access=mmap.ACCESS_READ)
+            self.shard_buffer_dict[shard_id] = shard_buffer
+        return shard_buffer
+
+    def get_picture_content(self, index):
+        index_entry = self.index_array[index]
+        offset, length = int(index_entry["offset"]), int(index_entry["length"])
+        return self.get_shard_buffer(int(index_entry["shard_id"]))[offset:offset + length]
+
+    def get_image(self, index, flags=1):
+        return cv2.imdecode(np.frombuffer(self.get_picture_content(index), dtype=np.uint8), flags)
+
+    def find(self, product_id, picture_id=0):
+        # The lookup table is sorted lazily, since sequential passes do not need it
+        if self.sorted_indexes is None:
+            packed_key_array = self.index_array["product_id"] * MAX_PICTURE_NUM + self.index_array["picture_id"]
+            self.sorted_indexes = np.argsort(packed_key_array, kind="mergesort")
+            self.sorted_packed_key_array = packed_key_array[self.sorted_indexes]
+        packed_key = product_id * MAX_PICTURE_NUM + picture_id
+        position = np.searchsorted(self.sorted_packed_key_array, packed_key)
+        if position == len(self.sorted_packed_key_array) or self.sorted_packed_key_array[position] != packed_key:
+            raise KeyError((product_id, picture_id))
+        return int(self.sorted_indexes[position])
+
+    def iterate(self, start_index=0, end_index=None):
+        # The pictures are stored in index order, so a sequential pass reads each shard from start to end
+        end_index = len(self) if end_index is None else end_index
+        for index in range(start_index, end_index):
+            yield self.index_array[index], self.get_picture_content(index)
+
+    def close(self):
+        for shard_buffer in self.shard_buffer_dict.values():
+            shard_buffer.close()
+        self.shard_buffer_dict = {}
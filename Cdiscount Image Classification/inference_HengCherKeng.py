@@ -5,11 +5,14 @@ import time
 import glob
 import numpy as np
 import pandas as pd
+from collections import deque
+from multiprocessing import Pool
+import image_shards
+import prediction_store
 
 # Import torch-related functions
 import torch
 import torch.nn.functional as F
-from torch.autograd import Variable
 
 # Dataset
 PROJECT_NAME = "Cdiscount Image Classification"
@@ -17,6 +20,7 @@ PROJECT_FOLDER_PATH = os.path.join(os.path.expanduser("~"), "Documents/Dataset",
 HENGCHERKENG_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "HengCherKeng")
 EXTRACTED_DATASET_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "extracted")
 TEST_FOLDER_PATH = os.path.join(EXTRACTED_DATASET_FOLDER_PATH, "test")
+TEST_SHARD_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "sharded", "test")
 SUBMISSION_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "submission")
 
 # Add the HengCherKeng folder to the path
@@ -34,151 +38,161 @@ HEIGHT, WIDTH = 180, 180
 NUM_CLASSES = 5270
 
 # Save top N predictions to disk
-TOP_N_PREDICTIONS = 5
-
-# Save predictions to disk when there are N entries
-SAVE_EVERY_N_ENTRIES = 1000
-
-def pytorch_image_to_tensor_transform(image):
-    mean = [0.485, 0.456, 0.406]
-    std = [0.229, 0.224, 0.225]
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    image = image.transpose((2, 0, 1))
-    tensor = torch.from_numpy(image).float().div(255)  # @UndefinedVariable
-    tensor[0] = (tensor[0] - mean[0]) / std[0]
-    tensor[1] = (tensor[1] - mean[1]) / std[1]
-    tensor[2] = (tensor[2] - mean[2]) / std[2]
-    return tensor
-
-def image_to_tensor_transform(image):
-    tensor = pytorch_image_to_tensor_transform(image)
-    tensor[0] = tensor[0] * (0.229 / 0.5) + (0.485 - 0.5) / 0.5
-    tensor[1] = tensor[1] * (0.224 / 0.5) + (0.456 - 0.5) / 0.5
-    tensor[2] = tensor[2] * (0.225 / 0.5) + (0.406 - 0.5) / 0.5
-    return tensor
-
-def append_entries_to_file(entry_list, file_path):
-    file_content = pd.DataFrame(entry_list)
-    file_content.to_csv(file_path, header=None, index=False, mode="a", float_format="%.2f", encoding="utf-8")
-
-def load_text_file(file_path, sep=",", header="infer", usecols=None, quoting=0, chunksize=1e4, encoding="utf-8"):
-    file_content = pd.read_csv(file_path, sep=sep, header=header, usecols=usecols, quoting=quoting, chunksize=chunksize, encoding=encoding)
-    for chunk in file_content:
-        for data in chunk.itertuples(index=False):
-            yield data
-
-def get_predictions_for_each_product(prediction_file_path_list):
-    accumulated_product_id = None
-    accumulated_label_index_and_prob_value_list = []
-    prediction_file_data_generator_list = [load_text_file(prediction_file_path, header=None) for prediction_file_path in prediction_file_path_list]
-    for data_tuple in zip(*prediction_file_data_generator_list):
-        # Unpack the values
-        product_id = data_tuple[0][0]
-        label_index_and_prob_value_list = []
-        for data in data_tuple:
-            label_index_and_prob_value_list += list(data[2:])
-
-        # Append the record if product_id is the same
-        if product_id == accumulated_product_id:
-            accumulated_label_index_and_prob_value_list += label_index_and_prob_value_list
-            continue
-
-        # Yield the accumulated records
-        if len(accumulated_label_index_and_prob_value_list) > 0:
-            yield accumulated_product_id, accumulated_label_index_and_prob_value_list
-
-        # Update the accumulated records
-        accumulated_product_id = product_id
-        accumulated_label_index_and_prob_value_list = label_index_and_prob_value_list
-
-    # Yield the accumulated records
-    if len(accumulated_label_index_and_prob_value_list) > 0:
-        yield accumulated_product_id, accumulated_label_index_and_prob_value_list
-
-def get_submission_from_prediction(prediction_file_path_list, label_index_to_category_id_dict, ensemble_func):
-    for product_id, label_index_and_prob_value_list in get_predictions_for_each_product(prediction_file_path_list):
-        label_index_to_prob_value_list_dict = {}
-        label_index_list = label_index_and_prob_value_list[0::2]
-        prob_value_list = label_index_and_prob_value_list[1::2]
-        for label_index, prob_value in zip(label_index_list, prob_value_list):
-            if label_index not in label_index_to_prob_value_list_dict:
-                label_index_to_prob_value_list_dict[label_index] = []
-            label_index_to_prob_value_list_dict[label_index].append(prob_value)
-
-        label_index_and_chosen_prob_value_array = np.array([(label_index, ensemble_func(prob_value_list)) for label_index, prob_value_list in label_index_to_prob_value_list_dict.items()])
-        chosen_label_index = label_index_and_chosen_prob_value_array[np.argmax(label_index_and_chosen_prob_value_array[:, 1]), 0].astype(np.int)
-        chosen_category_id = label_index_to_category_id_dict[chosen_label_index]
-
-        yield product_id, chosen_category_id
+TOP_N_PREDICTIONS = prediction_store.TOP_N_PREDICTIONS
+
+# Prediction files of previous runs, e.g., of the other model, which are ensembled together with the current one
+EXTRA_PREDICTION_FILE_PATH_LIST = []
+
+# Batched inference, i.e., the images are decoded by worker processes ahead of the forward passes
+BATCH_SIZE = 256
+BATCH_BUFFER_NUM = 2
+PREFETCH_BATCH_NUM = 4
+DECODER_PROCESS_NUM = os.cpu_count()
+DECODER_CHUNK_SIZE = 64
+WORKER_STATE = {}
+
+# The normalization of the network is x * (2 / 255) - 1 for every channel, since the ImageNet mean and std of the two affine steps cancel out
+FUSED_SCALE = 2 / 255
+FUSED_SHIFT = -1
+
+def fused_image_to_array_transform(image, output_array=None):
+    # The reversed channel axis converts BGR to RGB and the transposed view converts HWC to CHW,
+    # so the uint8 image is read once and the result is written into output_array without temporaries
+    if output_array is None:
+        output_array = np.empty((3,) + image.shape[:2], dtype=np.float32)
+    np.multiply(image[:, :, ::-1].transpose((2, 0, 1)), FUSED_SCALE, out=output_array, dtype=np.float32)
+    np.add(output_array, FUSED_SHIFT, out=output_array, dtype=np.float32)
+    return output_array
+
+def initialize_decoder_worker(shard_folder_path):
+    if shard_folder_path is not None:
+        WORKER_STATE["image_shard_reader"] = image_shards.ImageShardReader(shard_folder_path)
+
+def decode_image(source):
+    # The source is either the index of a picture in the shards, or the path of a JPEG file
+    image_shard_reader = WORKER_STATE.get("image_shard_reader")
+    return image_shard_reader.get_image(source) if image_shard_reader is not None else cv2.imread(source)
+
+def get_test_sources():
+    # Prefer the shards written by data_preprocessing.py, and fall back to the extracted JPEG files
+    if os.path.isfile(os.path.join(TEST_SHARD_FOLDER_PATH, image_shards.INDEX_FILE_NAME)):
+        index_array = np.load(os.path.join(TEST_SHARD_FOLDER_PATH, image_shards.INDEX_FILE_NAME))
+        return TEST_SHARD_FOLDER_PATH, range(len(index_array)), index_array["product_id"], index_array["picture_id"]
+    image_file_path_list = sorted(glob.glob(os.path.join(TEST_FOLDER_PATH, "*/*.jpg")))
+    id_array = np.array([os.path.basename(image_file_path).split(".")[0].split("_") for image_file_path in image_file_path_list], dtype=np.int64).reshape(-1, 2)
+    return None, image_file_path_list, id_array[:, 0], id_array[:, 1]
+
+def decode_images(source_list):
+    return [decode_image(source) for source in source_list]
+
+def iterate_image_batches(source_list, shard_folder_path, batch_size=BATCH_SIZE, prefetch_batch_num=PREFETCH_BATCH_NUM):
+    # Only a sliding window of chunks is submitted to the pool, so that at most prefetch_batch_num batches
+    # of decoded images wait in memory when the forward passes are slower than the decoders
+    chunk_iterator = (source_list[start_index:start_index + DECODER_CHUNK_SIZE] for start_index in range(0, len(source_list), DECODER_CHUNK_SIZE))
+    max_pending_chunk_num = max(1, prefetch_batch_num * batch_size // DECODER_CHUNK_SIZE)
+    with Pool(processes=DECODER_PROCESS_NUM, initializer=initialize_decoder_worker, initargs=(shard_folder_path,)) as pool:
+        pending_result_queue = deque()
+        image_list = []
+        while True:
+            while len(pending_result_queue) < max_pending_chunk_num:
+                chunk = next(chunk_iterator, None)
+                if chunk is None:
+                    break
+                pending_result_queue.append(pool.apply_async(decode_images, (chunk,)))
+            if len(pending_result_queue) == 0:
+                break
+
+            image_list += pending_result_queue.popleft().get()
+            while len(image_list) >= batch_size:
+                yield image_list[:batch_size]
+                image_list = image_list[batch_size:]
+        if len(image_list) > 0:
+            yield image_list
+
+def get_top_n_predictions(probs, top_n=TOP_N_PREDICTIONS):
+    # argpartition finds the top N of each row in linear time, and only those N entries are sorted
+    top_n_index_array = np.argpartition(-probs, top_n - 1, axis=1)[:, :top_n]
+    top_n_prob_array = np.take_along_axis(probs, top_n_index_array, axis=1)
+    sorted_indexes = np.argsort(-top_n_prob_array, axis=1, kind="mergesort")
+    return np.take_along_axis(top_n_index_array, sorted_indexes, axis=1), np.take_along_axis(top_n_prob_array, sorted_indexes, axis=1)
+
+def save_pending_batch(pending_batch, product_id_array, picture_id_array, prediction_store_writer):
+    # Wait for the copy of the probabilities of this batch only, the following batches keep running on the device
+    start_index, end_index, output_tensor, event = pending_batch
+    if event is not None:
+        event.synchronize()
+    top_n_index_array, top_n_prob_array = get_top_n_predictions(output_tensor[:end_index - start_index].numpy())
+    prediction_store_writer.append(product_id_array[start_index:end_index], picture_id_array[start_index:end_index], top_n_index_array, top_n_prob_array)
 
 def run():
     print("Creating folders ...")
     os.makedirs(SUBMISSION_FOLDER_PATH, exist_ok=True)
 
     print("Loading {} ...".format(MODEL_NAME))
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # @UndefinedVariable
     net = MODEL_FUNCTION(in_shape=(3, HEIGHT, WIDTH), num_classes=NUM_CLASSES)
-    net.load_state_dict(torch.load(os.path.join(HENGCHERKENG_FOLDER_PATH, MODEL_FILE_NAME)))
-    net.cuda().eval()
+    net.load_state_dict(torch.load(os.path.join(HENGCHERKENG_FOLDER_PATH, MODEL_FILE_NAME), map_location=device))
+    net.to(device).eval()
 
-    prediction_file_path = os.path.join(SUBMISSION_FOLDER_PATH, "{}_prediction_{}.csv".format(MODEL_NAME, time.strftime("%c")).replace(" ", "_").replace(":", "_"))
-    open(prediction_file_path, "w").close()
+    prediction_file_path = os.path.join(SUBMISSION_FOLDER_PATH, "{}_prediction_{}.bin".format(MODEL_NAME, time.strftime("%c")).replace(" ", "_").replace(":", "_"))
+    prediction_store_writer = prediction_store.PredictionStoreWriter(prediction_file_path, TOP_N_PREDICTIONS)
     print("Prediction will be saved to {}".format(prediction_file_path))
 
-    entry_list = []
-    image_file_path_list = sorted(glob.glob(os.path.join(TEST_FOLDER_PATH, "*/*.jpg")))
-    for image_file_path in image_file_path_list:
-        # Read image
-        image = cv2.imread(image_file_path)
-        x = image_to_tensor_transform(image)
-        x = Variable(x.unsqueeze(0), volatile=True).cuda()
-
-        # Inference
-        logits = net(x)
-        probs = F.softmax(logits)
-        probs = probs.cpu().data.numpy().reshape(-1)
-
-        # Get the top N predictions
-        top_n_index_array = probs.argsort()[-TOP_N_PREDICTIONS:][::-1]
-        top_n_prob_array = probs[top_n_index_array]
-
-        # Append the results
-        entry = [tuple(os.path.basename(image_file_path).split(".")[0].split("_"))] + [*zip(top_n_index_array, top_n_prob_array)]
-        entry_list.append([np.int64(item) if isinstance(item, str) else item for item_list in entry for item in item_list])
-
-        # Save predictions to disk
-        if len(entry_list) >= SAVE_EVERY_N_ENTRIES:
-            append_entries_to_file(entry_list, prediction_file_path)
-            entry_list = []
-
-    # Save predictions to disk
-    if len(entry_list) > 0:
-        append_entries_to_file(entry_list, prediction_file_path)
-        entry_list = []
-
-    print("Loading label_index_to_category_id_dict ...")
-    label_index_to_category_id_dict = dict(pd.read_csv(os.path.join(HENGCHERKENG_FOLDER_PATH, "label_index_to_category_id.csv"), header=None).itertuples(index=False))
+    # The buffers are allocated once and used in turn, so that a batch is converted while the previous one is copied
+    # to the device and processed. They are pinned so that the copies run asynchronously.
+    buffer_list = []
+    for _ in range(BATCH_BUFFER_NUM):
+        input_tensor = torch.empty((BATCH_SIZE, 3, HEIGHT, WIDTH), dtype=torch.float32)  # @UndefinedVariable
+        output_tensor = torch.empty((BATCH_SIZE, NUM_CLASSES), dtype=torch.float32)  # @UndefinedVariable
+        if device.type == "cuda":
+            input_tensor, output_tensor = input_tensor.pin_memory(), output_tensor.pin_memory()
+        buffer_list.append((input_tensor, output_tensor))
+
+    start_index = 0
+    pending_batch_queue = deque()
+    shard_folder_path, source_list, product_id_array, picture_id_array = get_test_sources()
+    print("Running inference on {} images with batch size {} on {} ...".format(len(source_list), BATCH_SIZE, device))
+    for batch_index, image_list in enumerate(iterate_image_batches(source_list, shard_folder_path)):
+        # Convert images
+        input_tensor, output_tensor = buffer_list[batch_index % BATCH_BUFFER_NUM]
+        input_array = input_tensor.numpy()
+        for image_index, image in enumerate(image_list):
+            fused_image_to_array_transform(image, input_array[image_index])
+
+        # Inference, the event marks the point where the probabilities of this batch are back in output_tensor
+        with torch.no_grad():
+            logits = net(input_tensor[:len(image_list)].to(device, non_blocking=True))
+            output_tensor[:len(image_list)].copy_(F.softmax(logits, dim=1), non_blocking=True)
+        event = torch.cuda.Event() if device.type == "cuda" else None
+        if event is not None:
+            event.record()
+        end_index = start_index + len(image_list)
+        pending_batch_queue.append((start_index, end_index, output_tensor, event))
+        start_index = end_index
+
+        # Save predictions to disk, before the buffers of the oldest batch are used again
+        if len(pending_batch_queue) == BATCH_BUFFER_NUM:
+            save_pending_batch(pending_batch_queue.popleft(), product_id_array, picture_id_array, prediction_store_writer)
+    while len(pending_batch_queue) > 0:
+        save_pending_batch(pending_batch_queue.popleft(), product_id_array, picture_id_array, prediction_store_writer)
+    prediction_store_writer.close()
+
+    print("Loading label_index_to_category_id_array ...")
+    label_index_to_category_id_df = pd.read_csv(os.path.join(HENGCHERKENG_FOLDER_PATH, "label_index_to_category_id.csv"), header=None)
+    label_index_to_category_id_array = np.zeros(label_index_to_category_id_df[0].max() + 1, dtype=np.int64)
+    label_index_to_category_id_array[label_index_to_category_id_df[0].values] = label_index_to_category_id_df[1].values
+
+    print("Aggregating predictions of each product ...")
+    ensemble_name_to_prediction_dict = prediction_store.aggregate_predictions([prediction_store.load_predictions(current_prediction_file_path)
+                                                                                for current_prediction_file_path in [prediction_file_path] + EXTRA_PREDICTION_FILE_PATH_LIST])
 
     print("Generating submission files from prediction files ...")
-    for ensemble_name, ensemble_func in zip(["min", "max", "mean", "median"], [np.min, np.max, np.mean, np.median]):
+    for ensemble_name in prediction_store.ENSEMBLE_NAME_LIST:
         submission_file_path = os.path.join(SUBMISSION_FOLDER_PATH, "ensembling_{}_{}.csv".format(ensemble_name, time.strftime("%c")).replace(" ", "_").replace(":", "_"))
-        with open(submission_file_path, "w") as submission_file_object:
-            submission_file_object.write("_id,category_id\n")
         print("Submission will be saved to {}".format(submission_file_path))
-
-        entry_list = []
-        for entry in get_submission_from_prediction([prediction_file_path], label_index_to_category_id_dict, ensemble_func):
-            # Append the results
-            entry_list.append(entry)
-
-            # Save submissions to disk
-            if len(entry_list) >= SAVE_EVERY_N_ENTRIES:
-                append_entries_to_file(entry_list, submission_file_path)
-                entry_list = []
-
-        # Save submissions to disk
-        if len(entry_list) > 0:
-            append_entries_to_file(entry_list, submission_file_path)
-            entry_list = []
+        product_id_array, chosen_label_index_array = ensemble_name_to_prediction_dict[ensemble_name]
+        submission_df = pd.DataFrame({"_id": product_id_array, "category_id": label_index_to_category_id_array[chosen_label_index_array]})
+        submission_df.to_csv(submission_file_path, index=False, columns=["_id", "category_id"], encoding="utf-8")
 
     print("All done!")
 
@@ -0,0 +1,76 @@
+import numpy as np
+
+# Each record holds the top N predictions of one picture, so that a prediction file is a flat array behind a small header
+FILE_SIGNATURE = b"TOPNPRED"
+HEADER_DTYPE = np.dtype([("signature", "S8"), ("top_n", np.uint64)])
+TOP_N_PREDICTIONS = 5
+ENSEMBLE_NAME_LIST = ["min", "max", "mean", "median"]
+
+def get_record_dtype(top_n=TOP_N_PREDICTIONS):
+    return np.dtype([("product_id", np.int64), ("picture_id", np.int16),
+                     ("label_index", np.int16, (top_n,)), ("prob_value", np.float16, (top_n,))])
+
+class PredictionStoreWriter(object):
+    # Appends the records of each batch to the end of the file
+
+    def __init__(self, file_path, top_n=TOP_N_PREDICTIONS):
+        self.file_path = file_path
+        self.record_dtype = get_record_dtype(top_n)
+        self.file_object = open(file_path, "wb")
+        np.array([(FILE_SIGNATURE, top_n)], dtype=HEADER_DTYPE).tofile(self.file_object)
+        self.record_num = 0
+
+    def append(self, product_id_array, picture_id_array, label_index_array, prob_value_array):
+        record_array = np.empty(len(product_id_array), dtype=self.record_dtype)
+        record_array["product_id"] = product_id_array
+        record_array["picture_id"] = picture_id_array
+        record_array["label_index"] = label_index_array
+        record_array["prob_value"] = prob_value_array
+        record_array.tofile(self.file_object)
+        self.record_num += len(record_array)
+
+    def close(self):
+        if self.file_object is not None:
+            self.file_object.close()
+            self.file_object = None
+        return self.record_num
+
+def load_predictions(file_path):
+    header = np.fromfile(file_path, dtype=HEADER_DTYPE, count=1)
+    assert len(header) == 1 and header[0]["signature"] == FILE_SIGNATURE, "{} is not a prediction file!".format(file_path)
+    return np.memmap(file_path, dtype=get_record_dtype(int(header[0]["top_n"])), mode="r", offset=HEADER_DTYPE.itemsize)
+
+def get_group_boundaries(*key_array_list):
+    # The key arrays are sorted, so a group starts wherever any of the keys changes
+    is_group_start_array = np.ones(len(key_array_list[0]), dtype=np.bool_)
+    for key_array in key_array_list:
+        is_group_start_array[1:] |= key_array[1:] != key_array[:-1]
+    group_start_array = np.flatnonzero(is_group_start_array)
+    return group_start_array, np.diff(np.append(group_start_array, len(key_array_list[0])))
+
+def aggregate_predictions(record_array_list, ensemble_name_list=ENSEMBLE_NAME_LIST):
+    # The records of all the prediction files are flattened into (product, label, prob) triples, so that files with different top N can be combined,
+    # and the triples are sorted once, so that min, max and median are positions within each group
+    product_id_array = np.concatenate([np.repeat(np.asarray(record_array["product_id"]), record_array.dtype["label_index"].shape[0]) for record_array in record_array_list])
+    label_index_array = np.concatenate([np.asarray(record_array["label_index"]).ravel() for record_array in record_array_list])
+    prob_value_array = np.concatenate([np.asarray(record_array["prob_value"]).ravel() for record_array in record_array_list]).astype(np.float32)
+    sorted_indexes = np.lexsort((prob_value_array, label_index_array, product_id_array))
+    product_id_array, label_index_array, prob_value_array = product_id_array[sorted_indexes], label_index_array[sorted_indexes], prob_value_array[sorted_indexes]
+
+    group_start_array, group_size_array = get_group_boundaries(product_id_array, label_index_array)
+    group_product_id_array, group_label_index_array = product_id_array[group_start_array], label_index_array[group_start_array]
+    ensemble_name_to_group_value_array_dict = {
+        "min": lambda: prob_value_array[group_start_array],
+        "max": lambda: prob_value_array[group_start_array + group_size_array - 1],
+        "mean": lambda: np.add.reduceat(prob_value_array, group_start_array) / group_size_array,
+        "median": lambda: (prob_value_array[group_start_array + (group_size_array - 1) // 2] + prob_value_array[group_start_array + group_size_array // 2]) / 2}
+
+    ensemble_name_to_prediction_dict = {}
+    for ensemble_name in ensemble_name_list:
+        # Within each product, the label with the highest aggregated value comes first, and ties go to the smaller label
+        group_value_array = ensemble_name_to_group_value_array_dict[ensemble_name]()
+        group_sorted_indexes = np.lexsort((group_label_index_array, -group_value_array, group_product_id_array))
+        product_start_array, _ = get_group_boundaries(group_product_id_array[group_sorted_indexes])
+        chosen_group_indexes = group_sorted_indexes[product_start_array]
+        ensemble_name_to_prediction_dict[ensemble_name] = (group_product_id_array[chosen_group_indexes], group_label_index_array[chosen_group_indexes].astype(np.int64))
+    return ensemble_name_to_prediction_dict
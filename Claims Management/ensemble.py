@@ -1,4 +1,3 @@
-import glob
 import numpy as np
 import os
 import pandas as pd
@@ -6,32 +5,50 @@ import preprocessing
 import solution
 import time
 
-OLD_SUBMISSION_FOLDER_PATH = solution.submission_folder_path
+PREDICTION_STORE_FOLDER_PATH = solution.prediction_store_folder_path
 NEW_SUBMISSION_FOLDER_PATH = "./"
+THRESHOLD_PAIR_LIST = [(0, 1), (0, 0.475), (0, 0.47), (0, 0.465), (0.47, 0.475)]
+PREFIX_SUM_CHUNK_SIZE = 100
 
-def perform_ensembling(low_threshold=0, high_threshold=1):
-    print("Reading the submission files from disk ...")
-    prediction_list = []
-    for submission_file_path in glob.glob(os.path.join(OLD_SUBMISSION_FOLDER_PATH, "*.csv")):
-        if os.path.basename(submission_file_path) < "Aurora_{:.4f}".format(low_threshold) or \
-            os.path.basename(submission_file_path) > "Aurora_{:.4f}".format(high_threshold):
-            continue
-        submission_file_content = pd.read_csv(submission_file_path)
-        prediction = submission_file_content[preprocessing.LABEL_COLUMN_NAME_IN_SUBMISSION].as_matrix()
-        prediction_list.append(prediction)
+def load_sorted_predictions(prediction_store_folder_path):
+    ID_test, score_array, prediction_array = preprocessing.load_prediction_store(prediction_store_folder_path)
+
+    # Sort by the score used in the Aurora_{score:.4f} file names, so that every score window is a contiguous block
+    rounded_score_array = np.round(score_array, 4)
+    sorted_indexes = np.argsort(rounded_score_array, kind="mergesort")
+    sorted_score_array = rounded_score_array[sorted_indexes]
+
+    # The sum of any block is the difference between two rows of the prefix sums, which are accumulated chunk by chunk
+    # from the memory-mapped store, so that the predictions are never held in memory next to their prefix sums
+    prefix_sum_array = np.zeros((len(sorted_indexes) + 1,) + prediction_array.shape[1:])
+    for start_index in range(0, len(sorted_indexes), PREFIX_SUM_CHUNK_SIZE):
+        chunk_indexes = sorted_indexes[start_index:start_index + PREFIX_SUM_CHUNK_SIZE]
+        chunk_prefix_sum_array = prefix_sum_array[start_index + 1:start_index + 1 + len(chunk_indexes)]
+        np.cumsum(prediction_array[chunk_indexes], axis=0, out=chunk_prefix_sum_array)
+        chunk_prefix_sum_array += prefix_sum_array[start_index]
+    return ID_test, sorted_score_array, sorted_indexes, prediction_array, prefix_sum_array
+
+def perform_ensembling(sorted_predictions, low_threshold=0, high_threshold=1):
+    ID_test, sorted_score_array, sorted_indexes, prediction_array, prefix_sum_array = sorted_predictions
+    start_index, end_index = np.searchsorted(sorted_score_array, [low_threshold, high_threshold])
+    if start_index == end_index:
+        print("Skipping [{:.4f}, {:.4f}) since no prediction falls into it ...".format(low_threshold, high_threshold))
+        return
+
+    print("Blending {:d} predictions with scores in [{:.4f}, {:.4f}) ...".format(end_index - start_index, low_threshold, high_threshold))
+    mean_prediction = (prefix_sum_array[end_index] - prefix_sum_array[start_index]) / (end_index - start_index)
+    median_prediction = np.median(prediction_array[np.sort(sorted_indexes[start_index:end_index])], axis=0)
 
     print("Writing the submission files to disk ...")
-    mean_prediction = np.mean(prediction_list, axis=0)
-    median_prediction = np.median(prediction_list, axis=0)
     for bias, prediction in enumerate([mean_prediction, median_prediction]):
         submission_file_name = "Ensemble_{:.4f}_to_{:.4f}_{:d}.csv".format(low_threshold, high_threshold, int(time.time()) + bias)
-        submission_file_content[preprocessing.LABEL_COLUMN_NAME_IN_SUBMISSION] = prediction
+        submission_file_content = pd.DataFrame({preprocessing.ID_COLUMN_NAME:ID_test, preprocessing.LABEL_COLUMN_NAME_IN_SUBMISSION:prediction})
         submission_file_content.to_csv(os.path.join(NEW_SUBMISSION_FOLDER_PATH, submission_file_name), index=False)
 
-perform_ensembling(0, 1)
-perform_ensembling(0, 0.475)
-perform_ensembling(0, 0.47)
-perform_ensembling(0, 0.465)
-perform_ensembling(0.47, 0.475)
+print("Reading the prediction store from disk ...")
+sorted_predictions = load_sorted_predictions(PREDICTION_STORE_FOLDER_PATH)
+
+for low_threshold, high_threshold in THRESHOLD_PAIR_LIST:
+    perform_ensembling(sorted_predictions, low_threshold, high_threshold)
 
 print("All done!")
@@ -1,6 +1,7 @@
-from sklearn.preprocessing import LabelEncoder, OneHotEncoder
 import numpy as np
+import os
 import pandas as pd
+import sys
 
 TRAINING_FILE_PATH = "./input/train.csv"
 TESTING_FILE_PATH = "./input/test.csv"
@@ -8,9 +9,10 @@ ID_COLUMN_NAME = "ID"
 LABEL_COLUMN_NAME = "target"
 LABEL_COLUMN_NAME_IN_SUBMISSION = "PredictedProb"
 
-def perform_categorization(column_vector):
-    encoder = LabelEncoder()
-    return encoder.fit_transform(column_vector).astype(np.int)
+# Add the shared Tabular Pipeline folder to the path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Tabular Pipeline"))
+from tabular_data import get_one_hot_feature_matrix, load_preprocessed_data  # @UnresolvedImport pylint: disable=import-error
+from tabular_data import reset_prediction_store, append_to_prediction_store, load_prediction_store  # @UnresolvedImport pylint: disable=import-error
 
 def convert_hexavigesimal_value(original_string):
     if pd.isnull(original_string):
@@ -19,7 +21,7 @@ def convert_hexavigesimal_value(original_string):
     weight_list = [26 ** item for item in range(len(original_string) - 1, 0 - 1, -1)]
     return np.dot(value_list, weight_list)
 
-def load_data():
+def perform_preprocessing():
     # Read file content
     training_file_content = pd.read_csv(TRAINING_FILE_PATH)
     testing_file_content = pd.read_csv(TESTING_FILE_PATH)
@@ -37,27 +39,18 @@ def load_data():
                                 "v117", "v118", "v119", "v123", "v124", "v128"], axis=1, inplace=True)
 
     # Manipulate file content
-    X = combined_file_content.as_matrix()
-    categorical_features_mask_list = []
-    for column_vector in X.T:
-        valid_elements_mask = np.logical_not(pd.isnull(column_vector))
-        if np.can_cast(type(column_vector[valid_elements_mask][0]), np.float):
-            categorical_features_mask_list.append(False)
-            min_value = np.min(column_vector[valid_elements_mask])
-            column_vector[np.logical_not(valid_elements_mask)] = min_value - 1
-        else:
-            categorical_features_mask_list.append(True)
-            column_vector[np.logical_not(valid_elements_mask)] = "Missing"
-            column_vector[:] = perform_categorization(column_vector)
-    encoder = OneHotEncoder(categorical_features=categorical_features_mask_list)
-    X = encoder.fit_transform(X).toarray()
+    X, encoder = get_one_hot_feature_matrix(combined_file_content)
 
     # Separate the training and testing data set
     valid_elements_mask = np.logical_not(pd.isnull(Y))
     X_train = X[valid_elements_mask]
     Y_train = Y[valid_elements_mask]
     X_test = X[np.logical_not(valid_elements_mask)]
-    submission_file_content = pd.DataFrame({ID_COLUMN_NAME:testing_file_content[ID_COLUMN_NAME],
-                                            LABEL_COLUMN_NAME_IN_SUBMISSION:np.zeros(testing_file_content.shape[0])})
+    ID_test = testing_file_content[ID_COLUMN_NAME].as_matrix()
+
+    return X_train, Y_train, X_test, ID_test, {"feature_encoder": encoder}
 
+def load_data():
+    (X_train, Y_train, X_test, ID_test), encoder_dict = load_preprocessed_data(perform_preprocessing, [TRAINING_FILE_PATH, TESTING_FILE_PATH, os.path.realpath(__file__)])
+    submission_file_content = pd.DataFrame({ID_COLUMN_NAME:ID_test, LABEL_COLUMN_NAME_IN_SUBMISSION:np.zeros(len(ID_test))})
     return X_train, Y_train, X_test, submission_file_content
@@ -1,16 +1,16 @@
 from fine_tune import *
-import copy
 import os
 import preprocessing
-import shutil
-import time
+import xgboost as xgb
 
-submission_folder_path = "/tmp/submissions"
+prediction_store_folder_path = "/tmp/prediction_store"
 
-def generate_prediction(estimator, X_train, Y_train, X_test, submission_file_content, early_stopping_rounds=100, cv_num=1):
+def generate_prediction(estimator, X_train, Y_train, X_test, early_stopping_rounds=100, cv_num=1):
     best_iteration_list = []
     best_score_list = []
 
+    X_train = X_train.astype(tuning_engine.FEATURE_DTYPE, copy=False)
+    test_matrix = xgb.DMatrix(X_test.astype(tuning_engine.FEATURE_DTYPE, copy=False), missing=np.nan)
     for cv_index, _ in enumerate(range(cv_num), start=1):
         print("Working on CV {:d}/{:d} ...".format(cv_index, cv_num))
 
@@ -18,25 +18,18 @@ def generate_prediction(estimator, X_train, Y_train, X_test, submission_file_con
         for cv_fold_index, (train_indexes, validate_indexes) in enumerate(cv_object, start=1):
             print("Working on fold {:d}/{:d} ...".format(cv_fold_index, CV_FOLD_NUM))
 
-            cv_X_train, cv_X_validate = X_train[train_indexes], X_train[validate_indexes]
-            cv_Y_train, cv_Y_validate = Y_train[train_indexes], Y_train[validate_indexes]
-            temp_estimator = copy.deepcopy(estimator)
-            temp_estimator.fit(cv_X_train, cv_Y_train, eval_set=[(cv_X_validate, cv_Y_validate)], eval_metric=EVAL_METRIC,
-                          early_stopping_rounds=early_stopping_rounds, verbose=False)
-            best_score = temp_estimator.best_score
-            best_iteration = temp_estimator.best_iteration
+            train_matrix, validate_matrix = tuning_engine.get_fold_matrices(X_train, Y_train, train_indexes, validate_indexes)
+            booster = TUNING_ENGINE.train_booster(estimator, train_matrix, validate_matrix, early_stopping_rounds)
+            best_score = booster.best_score
+            best_iteration = booster.best_iteration
 
-            best_param = {"n_estimators":best_iteration}
-            temp_estimator = copy.deepcopy(estimator)
-            temp_estimator.set_params(**best_param)
-            temp_estimator.fit(cv_X_train, cv_Y_train, verbose=False)
-
-            proba = temp_estimator.predict_proba(X_test)
+            if tuning_engine.TRAIN_ONCE:
+                proba = tuning_engine.predict_proba(booster, test_matrix, ntree_limit=booster.best_ntree_limit)
+            else:
+                booster = xgb.train(TUNING_ENGINE.get_booster_params(estimator, train_matrix), train_matrix, num_boost_round=best_iteration)
+                proba = tuning_engine.predict_proba(booster, test_matrix)
             prediction = proba[:, 1]
-
-            submission_file_name = "Aurora_{:.4f}_{:d}.csv".format(best_score, int(time.time()))
-            submission_file_content[preprocessing.LABEL_COLUMN_NAME_IN_SUBMISSION] = prediction
-            submission_file_content.to_csv(os.path.join(submission_folder_path, submission_file_name), index=False)
+            preprocessing.append_to_prediction_store(prediction_store_folder_path, best_score, prediction)
 
             best_iteration_list.append(best_iteration)
             best_score_list.append(best_score)
@@ -46,13 +39,12 @@ def generate_prediction(estimator, X_train, Y_train, X_test, submission_file_con
     return np.int(np.median(best_iteration_list)), np.median(best_score_list)
 
 def run():
-    print("Resetting the submission folder {:s} ...".format(os.path.basename(submission_folder_path)))
-    shutil.rmtree(submission_folder_path, ignore_errors=True)
-    os.makedirs(submission_folder_path)
-
     print("Loading data ...")
     X_train, Y_train, X_test, submission_file_content = preprocessing.load_data()
 
+    print("Resetting the prediction store {:s} ...".format(os.path.basename(prediction_store_folder_path)))
+    preprocessing.reset_prediction_store(prediction_store_folder_path, submission_file_content[preprocessing.ID_COLUMN_NAME].as_matrix())
+
     print("Tuning parameters ...")
     optimal_max_depth, optimal_min_child_weight, optimal_subsample, optimal_colsample_bytree = perform_tuning(X_train, Y_train)
 
@@ -61,7 +53,7 @@ def run():
     estimator = XGBClassifier(max_depth=optimal_max_depth, learning_rate=optimal_learning_rate, n_estimators=1000000,
                               min_child_weight=optimal_min_child_weight, subsample=optimal_subsample,
                               colsample_bytree=optimal_colsample_bytree, objective=OBJECTIVE)
-    generate_prediction(estimator, X_train, Y_train, X_test, submission_file_content, early_stopping_rounds=200, cv_num=20)
+    generate_prediction(estimator, X_train, Y_train, X_test, early_stopping_rounds=200, cv_num=20)
 
     print("All done!")
 
@@ -1,6 +1,7 @@
-from sklearn.preprocessing import LabelEncoder, OneHotEncoder
 import numpy as np
+import os
 import pandas as pd
+import sys
 
 TRAINING_FILE_PATH = "./input/training.csv"
 TESTING_FILE_PATH = "./input/testing.csv"
@@ -8,31 +9,19 @@ ID_COLUMN_NAME = "customer_id"
 LABEL_COLUMN_NAME = "target"
 LABEL_COLUMN_NAME_IN_SUBMISSION = LABEL_COLUMN_NAME
 
-def perform_categorization(column_vector):
-    encoder = LabelEncoder()
-    return encoder.fit_transform(column_vector).astype(np.int)
+# Add the shared Tabular Pipeline folder to the path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Tabular Pipeline"))
+from tabular_data import get_one_hot_feature_matrix, load_preprocessed_data  # @UnresolvedImport pylint: disable=import-error
+from tabular_data import reset_prediction_store, append_to_prediction_store, load_prediction_store  # @UnresolvedImport pylint: disable=import-error
 
-def load_data():
+def perform_preprocessing():
     # Read file content
     training_file_content = pd.read_csv(TRAINING_FILE_PATH)
     testing_file_content = pd.read_csv(TESTING_FILE_PATH)
     combined_file_content = pd.concat([training_file_content, testing_file_content])
 
     # Manipulate file content
-    X = combined_file_content.drop([ID_COLUMN_NAME, LABEL_COLUMN_NAME], axis=1).as_matrix()
-    categorical_features_mask_list = []
-    for column_vector in X.T:
-        valid_elements_mask = np.logical_not(pd.isnull(column_vector))
-        if np.can_cast(type(column_vector[valid_elements_mask][0]), np.float):
-            categorical_features_mask_list.append(False)
-            min_value = np.min(column_vector[valid_elements_mask])
-            column_vector[np.logical_not(valid_elements_mask)] = min_value - 1
-        else:
-            categorical_features_mask_list.append(True)
-            column_vector[np.logical_not(valid_elements_mask)] = "Missing"
-            column_vector[:] = perform_categorization(column_vector)
-    encoder = OneHotEncoder(categorical_features=categorical_features_mask_list)
-    X = encoder.fit_transform(X).toarray()
+    X, encoder = get_one_hot_feature_matrix(combined_file_content.drop([ID_COLUMN_NAME, LABEL_COLUMN_NAME], axis=1))
 
     # Separate the data set
     Y = combined_file_content[LABEL_COLUMN_NAME].as_matrix()
@@ -43,6 +32,10 @@ def load_data():
     X_test = X[test_data_mask]
     ID_test = ID[test_data_mask]
 
+    return X_train, Y_train, X_test, ID_test, {"feature_encoder": encoder}
+
+def load_data():
+    (X_train, Y_train, X_test, ID_test), encoder_dict = load_preprocessed_data(perform_preprocessing, [TRAINING_FILE_PATH, TESTING_FILE_PATH, os.path.realpath(__file__)])
     return X_train, Y_train, X_test, ID_test
 
 def write_submission(ID_test, prediction, submission_file_path):
@@ -1,6 +1,8 @@
 from itertools import combinations
 import numpy as np
+import os
 import pandas as pd
+import sys
 
 TRAINING_FILE_PATH = "./input/train.csv"
 TESTING_FILE_PATH = "./input/test.csv"
@@ -8,37 +10,43 @@ ID_COLUMN_NAME = "ID"
 LABEL_COLUMN_NAME = "TARGET"
 LABEL_COLUMN_NAME_IN_SUBMISSION = LABEL_COLUMN_NAME
 
-def load_data():
+# Add the shared Tabular Pipeline folder to the path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Tabular Pipeline"))
+from tabular_data import load_preprocessed_data  # @UnresolvedImport pylint: disable=import-error
+from tabular_data import reset_prediction_store, append_to_prediction_store, load_prediction_store  # @UnresolvedImport pylint: disable=import-error
+
+def perform_preprocessing():
     # Read file content
     training_file_content = pd.read_csv(TRAINING_FILE_PATH)
     testing_file_content = pd.read_csv(TESTING_FILE_PATH)
     combined_file_content = pd.concat([training_file_content, testing_file_content])
 
     # Remove constant columns
-    invalid_column_name_list = []
-    for current_column_name in combined_file_content.columns.values:
-        current_column_array = combined_file_content[current_column_name].as_matrix()
-        if np.unique(current_column_array).size == 1:
-            invalid_column_name_list.append(current_column_name)
+    unique_value_num_series = combined_file_content.nunique(dropna=False)
+    invalid_column_name_list = list(unique_value_num_series.index[unique_value_num_series.values == 1])
     combined_file_content.drop(invalid_column_name_list, axis=1, inplace=True)
     print("{:d} constant columns removed.".format(len(invalid_column_name_list)))
 
-    # Remove duplicated columns
+    # Remove duplicated columns, only comparing the columns which share the same hash value
+    column_name_list_dict = {}
+    for current_column_name in combined_file_content.columns.values:
+        column_hash_value = pd.util.hash_pandas_object(combined_file_content[current_column_name].astype(np.float64), index=False).values.sum()
+        column_name_list_dict.setdefault(column_hash_value, []).append(current_column_name)
     invalid_column_name_list = []
-    for current_column_name_1, current_column_name_2 in combinations(combined_file_content.columns.values, 2):
-        if current_column_name_1 in invalid_column_name_list or current_column_name_2 in invalid_column_name_list:
-            continue
-
-        current_column_array_1 = combined_file_content[current_column_name_1].as_matrix()
-        current_column_array_2 = combined_file_content[current_column_name_2].as_matrix()
-        if np.array_equal(current_column_array_1, current_column_array_2):
-            invalid_column_name_list.append(current_column_name_2)
+    for column_name_list in column_name_list_dict.values():
+        for current_column_name_1, current_column_name_2 in combinations(column_name_list, 2):
+            if current_column_name_1 in invalid_column_name_list or current_column_name_2 in invalid_column_name_list:
+                continue
+
+            current_column_array_1 = combined_file_content[current_column_name_1].as_matrix()
+            current_column_array_2 = combined_file_content[current_column_name_2].as_matrix()
+            if np.array_equal(current_column_array_1, current_column_array_2):
+                invalid_column_name_list.append(current_column_name_2)
     combined_file_content.drop(invalid_column_name_list, axis=1, inplace=True)
     print("{:d} duplicated columns removed.".format(len(invalid_column_name_list)))
 
     # Feature engineering
-    combined_file_content["zero_num"] = [np.sum(current_row.drop([ID_COLUMN_NAME, LABEL_COLUMN_NAME]) == 0)
-                                         for _, current_row in combined_file_content.iterrows()]
+    combined_file_content["zero_num"] = np.sum(combined_file_content.drop([ID_COLUMN_NAME, LABEL_COLUMN_NAME], axis=1).as_matrix() == 0, axis=1)
 
     # Separate the data set
     X = combined_file_content.drop([ID_COLUMN_NAME, LABEL_COLUMN_NAME], axis=1).as_matrix()
@@ -50,6 +58,10 @@ def load_data():
     X_test = X[test_data_mask]
     ID_test = ID[test_data_mask]
 
+    return X_train, Y_train, X_test, ID_test, {}
+
+def load_data():
+    (X_train, Y_train, X_test, ID_test), encoder_dict = load_preprocessed_data(perform_preprocessing, [TRAINING_FILE_PATH, TESTING_FILE_PATH, os.path.realpath(__file__)])
     return X_train, Y_train, X_test, ID_test
 
 def write_submission(ID_test, prediction, submission_file_path):
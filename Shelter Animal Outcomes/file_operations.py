@@ -1,7 +1,9 @@
 from dateutil.parser import parse
-from sklearn.preprocessing import LabelEncoder, OneHotEncoder
+from sklearn.preprocessing import LabelEncoder
 import numpy as np
+import os
 import pandas as pd
+import sys
 
 TRAINING_FILE_PATH = "./input/train.csv"
 TESTING_FILE_PATH = "./input/test.csv"
@@ -9,9 +11,10 @@ ID_COLUMN_NAME = "ID"
 LABEL_COLUMN_NAME = "OutcomeType"
 LABEL_COLUMN_NAME_LIST_IN_SUBMISSION = None
 
-def perform_categorization(column_vector):
-    encoder = LabelEncoder()
-    return encoder.fit_transform(column_vector).astype(np.int)
+# Add the shared Tabular Pipeline folder to the path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Tabular Pipeline"))
+from tabular_data import get_one_hot_feature_matrix, load_preprocessed_data  # @UnresolvedImport pylint: disable=import-error
+from tabular_data import reset_prediction_store, append_to_prediction_store, load_prediction_store  # @UnresolvedImport pylint: disable=import-error
 
 def get_age_in_months(input):
     try:
@@ -28,7 +31,7 @@ def get_age_in_months(input):
     except:
         return np.nan
 
-def load_data():
+def perform_preprocessing():
     # Read file content
     training_file_content = pd.read_csv(TRAINING_FILE_PATH)
     testing_file_content = pd.read_csv(TESTING_FILE_PATH)
@@ -64,20 +67,7 @@ def load_data():
     combined_file_content.drop(["Color"], axis=1, inplace=True)
 
     # Manipulate file content
-    X = combined_file_content.drop([ID_COLUMN_NAME, LABEL_COLUMN_NAME], axis=1).as_matrix()
-    categorical_features_mask_list = []
-    for column_vector in X.T:
-        valid_elements_mask = np.logical_not(pd.isnull(column_vector))
-        if np.can_cast(type(column_vector[valid_elements_mask][0]), np.float):
-            categorical_features_mask_list.append(False)
-            min_value = np.min(column_vector[valid_elements_mask])
-            column_vector[np.logical_not(valid_elements_mask)] = min_value - 1
-        else:
-            categorical_features_mask_list.append(True)
-            column_vector[np.logical_not(valid_elements_mask)] = "Missing"
-            column_vector[:] = perform_categorization(column_vector)
-    encoder = OneHotEncoder(categorical_features=categorical_features_mask_list)
-    X = encoder.fit_transform(X).toarray()
+    X, encoder = get_one_hot_feature_matrix(combined_file_content.drop([ID_COLUMN_NAME, LABEL_COLUMN_NAME], axis=1))
 
     # Separate the data set
     Y = combined_file_content[LABEL_COLUMN_NAME].as_matrix()
@@ -89,10 +79,17 @@ def load_data():
     ID_test = ID[test_data_mask]
 
     # Convert labels to numerical values
+    label_encoder = LabelEncoder()
+    Y_train = label_encoder.fit_transform(Y_train)
+
+    return X_train, Y_train, X_test, ID_test, {"feature_encoder": encoder, "label_encoder": label_encoder}
+
+def load_data():
+    (X_train, Y_train, X_test, ID_test), encoder_dict = load_preprocessed_data(perform_preprocessing, [TRAINING_FILE_PATH, TESTING_FILE_PATH, os.path.realpath(__file__)])
+
+    # Restore the label names used in the submission
     global LABEL_COLUMN_NAME_LIST_IN_SUBMISSION
-    encoder = LabelEncoder()
-    Y_train = encoder.fit_transform(Y_train)
-    LABEL_COLUMN_NAME_LIST_IN_SUBMISSION = encoder.classes_
+    LABEL_COLUMN_NAME_LIST_IN_SUBMISSION = encoder_dict["label_encoder"].classes_
 
     return X_train, Y_train, X_test, ID_test
 
@@ -1,30 +1,25 @@
 import XGBoost
 import file_operations
 import os
-import shutil
 
-SUBMISSION_FOLDER_PATH = "/tmp/submissions"
+PREDICTION_STORE_FOLDER_PATH = "/tmp/prediction_store"
 
 def run():
-    print("Resetting the submission folder {:s} ...".format(os.path.basename(SUBMISSION_FOLDER_PATH)))
-    shutil.rmtree(SUBMISSION_FOLDER_PATH, ignore_errors=True)
-    os.makedirs(SUBMISSION_FOLDER_PATH)
-
     print("Loading data ...")
     X_train, Y_train, X_test, ID_test = file_operations.load_data()
 
+    print("Resetting the prediction store {:s} ...".format(os.path.basename(PREDICTION_STORE_FOLDER_PATH)))
+    file_operations.reset_prediction_store(PREDICTION_STORE_FOLDER_PATH, ID_test)
+
     print("Performing tuning ...")
     optimal_parameters = XGBoost.perform_tuning(X_train, Y_train)
 
     print("Generating predictions ...")
     prediction_num = 100
-    for prediction_index in range(1, prediction_num + 1):
+    prediction_generator = XGBoost.generate_predictions(X_train, Y_train, X_test, optimal_parameters, range(1, prediction_num + 1))
+    for prediction_index, (score, prediction) in enumerate(prediction_generator, start=1):
         print("Working on prediction {:d}/{:d} ...".format(prediction_index, prediction_num))
-        score, prediction = XGBoost.generate_prediction(X_train, Y_train, X_test, optimal_parameters, random_state=prediction_index)
-
-        submission_file_name = "Aurora_{:.4f}_{:d}.csv".format(score, prediction_index)
-        submission_file_path = os.path.join(SUBMISSION_FOLDER_PATH, submission_file_name)
-        file_operations.write_submission(ID_test, prediction, submission_file_path)
+        file_operations.append_to_prediction_store(PREDICTION_STORE_FOLDER_PATH, score, prediction)
 
     print("All done!")
 
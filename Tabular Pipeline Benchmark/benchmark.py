@@ -0,0 +1,321 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import runpy
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# Add the shared Tabular Pipeline folder to the path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Tabular Pipeline"))
+from memory_status import reset_peak_rss, read_memory_status_in_MB  # @UnresolvedImport pylint: disable=import-error
+
+# The folders of the tabular pipelines which are benchmarked, by default in this repository
+REPOSITORY_FOLDER_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+DATASET_NAME_TO_FOLDER_NAME_DICT = {"Titanic": "Titanic",
+                                    "Claims Management": "Claims Management",
+                                    "Customer Satisfaction": "Customer Satisfaction"}
+
+# Number of rows in train.csv and test.csv combined, before applying the scale factor
+DATASET_NAME_TO_ROW_NUM_DICT = {"Titanic": 1309, "Claims Management": 22871, "Customer Satisfaction": 15202}
+TRAIN_RATIO = 0.5
+
+# Columns of the synthetic Claims Management data
+CLAIMS_COLUMN_NUM = 131
+CLAIMS_CATEGORICAL_COLUMN_NAME_LIST = ["v3", "v22", "v24", "v30", "v31", "v47", "v52", "v56", "v66", "v71",
+                                       "v74", "v75", "v79", "v91", "v107", "v110", "v112", "v113", "v125"]
+CLAIMS_HIGH_CARDINALITY_COLUMN_NAME_LIST = ["v22", "v56", "v125"]
+
+# Columns of the synthetic Customer Satisfaction data
+SATISFACTION_COLUMN_NUM = 369
+SATISFACTION_CONSTANT_COLUMN_NUM = 34
+SATISFACTION_DUPLICATED_COLUMN_NUM = 29
+
+def get_random_strings(random_state, row_num, max_length, alphabet_size):
+    alphabet_array = np.array(list(string.ascii_uppercase[:alphabet_size]))
+    length_array = random_state.randint(1, max_length + 1, size=row_num)
+    letter_array = random_state.choice(alphabet_array, size=(row_num, max_length))
+    return np.array(["".join(letter_list[:length]) for letter_list, length in zip(letter_array, length_array)], dtype=object)
+
+def add_missing_values(random_state, value_array, missing_ratio):
+    value_array = value_array.astype(object) if value_array.dtype.kind in "OU" else value_array.astype(np.float64)
+    value_array[random_state.rand(len(value_array)) < missing_ratio] = np.nan
+    return value_array
+
+def get_label_array(random_state, score_array, positive_ratio):
+    # Labels follow the score with some noise, so that the models have something to learn
+    noisy_score_array = score_array + random_state.normal(scale=np.std(score_array) + 1e-6, size=len(score_array))
+    return (noisy_score_array > np.percentile(noisy_score_array, 100 * (1 - positive_ratio))).astype(np.int)
+
+def generate_titanic_data(random_state, row_num):
+    data_dict = {"PassengerId": np.arange(1, row_num + 1),
+                 "Pclass": random_state.randint(1, 4, size=row_num),
+                 "Name": np.array(["Passenger, Mr. {}".format(index) for index in range(row_num)], dtype=object),
+                 "Sex": random_state.choice(np.array(["male", "female"], dtype=object), size=row_num),
+                 "Age": add_missing_values(random_state, np.round(random_state.uniform(0.5, 80, size=row_num)), 0.2),
+                 "SibSp": random_state.randint(0, 6, size=row_num),
+                 "Parch": random_state.randint(0, 6, size=row_num),
+                 "Ticket": np.array(["T{}".format(value) for value in random_state.randint(0, 1000000, size=row_num)], dtype=object),
+                 "Fare": np.round(random_state.exponential(30, size=row_num), 4),
+                 "Cabin": add_missing_values(random_state, get_random_strings(random_state, row_num, 3, 8), 0.77),
+                 "Embarked": add_missing_values(random_state, random_state.choice(np.array(["S", "C", "Q"], dtype=object), size=row_num), 0.01)}
+    score_array = (data_dict["Sex"] == "female") * 2.0 - data_dict["Pclass"]
+    data_dict["Survived"] = get_label_array(random_state, score_array, 0.38)
+    column_name_list = ["PassengerId", "Survived", "Pclass", "Name", "Sex", "Age", "SibSp", "Parch", "Ticket", "Fare", "Cabin", "Embarked"]
+    return pd.DataFrame(data_dict, columns=column_name_list), "Survived"
+
+def generate_claims_data(random_state, row_num):
+    data_dict = {"ID": np.arange(1, row_num + 1)}
+    # Most of the numerical columns are missing together, like in the original data
+    missing_row_mask = random_state.rand(row_num) < 0.4
+    for column_index in range(1, CLAIMS_COLUMN_NUM + 1):
+        column_name = "v{}".format(column_index)
+        if column_name in CLAIMS_HIGH_CARDINALITY_COLUMN_NAME_LIST:
+            value_array = get_random_strings(random_state, row_num, 4, 26)
+        elif column_name in CLAIMS_CATEGORICAL_COLUMN_NAME_LIST:
+            value_array = get_random_strings(random_state, row_num, 1, random_state.randint(2, 26))
+        else:
+            value_array = random_state.uniform(0, 20, size=row_num)
+            value_array[missing_row_mask] = np.nan
+        data_dict[column_name] = add_missing_values(random_state, value_array, 0.03)
+    score_array = np.nan_to_num(data_dict["v50"]) + (data_dict["v66"] == "A")
+    data_dict["target"] = get_label_array(random_state, score_array, 0.76)
+    column_name_list = ["ID", "target"] + ["v{}".format(column_index) for column_index in range(1, CLAIMS_COLUMN_NUM + 1)]
+    return pd.DataFrame(data_dict, columns=column_name_list), "target"
+
+def generate_satisfaction_data(random_state, row_num):
+    data_dict = {"ID": np.arange(1, row_num + 1)}
+    column_name_list = ["var{}".format(column_index) for column_index in range(SATISFACTION_COLUMN_NUM)]
+    for column_index, column_name in enumerate(column_name_list):
+        if column_index < SATISFACTION_CONSTANT_COLUMN_NUM:
+            data_dict[column_name] = np.zeros(row_num, dtype=np.int)
+        else:
+            # Mostly zero counts and amounts
+            value_array = random_state.poisson(3, size=row_num) * (random_state.rand(row_num) < 0.1)
+            data_dict[column_name] = value_array if column_index % 2 == 0 else value_array * random_state.uniform(0, 1000)
+    # Some columns are exact copies of the last columns
+    for column_index in range(SATISFACTION_DUPLICATED_COLUMN_NUM):
+        data_dict[column_name_list[SATISFACTION_CONSTANT_COLUMN_NUM + column_index]] = data_dict[column_name_list[-1 - column_index]]
+    score_array = data_dict[column_name_list[-1]] + data_dict[column_name_list[-2]]
+    data_dict["TARGET"] = get_label_array(random_state, score_array, 0.04)
+    return pd.DataFrame(data_dict, columns=["ID"] + column_name_list + ["TARGET"]), "TARGET"
+
+DATASET_NAME_TO_GENERATOR_DICT = {"Titanic": generate_titanic_data,
+                                  "Claims Management": generate_claims_data,
+                                  "Customer Satisfaction": generate_satisfaction_data}
+
+def write_synthetic_data(dataset_name, row_num, working_folder_path, seed):
+    random_state = np.random.RandomState(seed)
+    file_content, label_column_name = DATASET_NAME_TO_GENERATOR_DICT[dataset_name](random_state, row_num)
+    train_num = int(row_num * TRAIN_RATIO)
+    input_folder_path = os.path.join(working_folder_path, "input")
+    os.makedirs(input_folder_path, exist_ok=True)
+    file_content.iloc[:train_num].to_csv(os.path.join(input_folder_path, "train.csv"), index=False)
+    file_content.iloc[train_num:].drop(label_column_name, axis=1).to_csv(os.path.join(input_folder_path, "test.csv"), index=False)
+
+def run_stage(stage_record_list, stage_name, stage_function, *args, **kwargs):
+    print("Running stage {} ...".format(stage_name))
+    is_peak_rss_reset = reset_peak_rss()
+    children_peak_rss_before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    start_time = time.perf_counter()
+    result = stage_function(*args, **kwargs)
+    wall_time = time.perf_counter() - start_time
+    children_peak_rss_after = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    stage_record_list.append({"stage": stage_name, "wall_time": wall_time, "peak_rss_MB": read_memory_status_in_MB()[1],
+                              "is_peak_rss_per_stage": is_peak_rss_reset,
+                              "children_peak_rss_MB": children_peak_rss_after / 1024 if children_peak_rss_after > children_peak_rss_before else None})
+    print("Stage {} took {:.2f} seconds.".format(stage_name, wall_time))
+    return result
+
+def redirect_folder_paths(module, working_folder_path, attribute_name_list):
+    # Only the attributes which exist in the benchmarked tree are redirected into the working folder
+    for attribute_name in attribute_name_list:
+        if module is not None and hasattr(module, attribute_name):
+            setattr(module, attribute_name, os.path.join(working_folder_path, attribute_name.lower()))
+
+def configure_tuning_engine(tuning_engine, working_folder_path, quick):
+    # Older trees tune with hardcoded search spaces and without any cache
+    if tuning_engine is None:
+        if quick:
+            print("Ignoring --quick since this tree has no tuning engine ...")
+        return
+    tuning_engine.tuning_cache_folder_path = os.path.join(working_folder_path, "tuning_cache")
+    if quick:
+        # Only keep the first two values of each search space
+        tuning_engine.search_space_list = [(parameter_name, search_space[:2]) for parameter_name, search_space in tuning_engine.search_space_list]
+
+def benchmark_xgboost_pipeline(pipeline_folder_path, working_folder_path, prediction_num, quick):
+    import XGBoost  # @UnresolvedImport pylint: disable=import-error
+    import file_operations  # @UnresolvedImport pylint: disable=import-error
+    import solution  # @UnresolvedImport pylint: disable=import-error
+
+    # The features below are detected, so that the same stages are measured on trees from before and after they were added
+    redirect_folder_paths(sys.modules.get("tabular_data"), working_folder_path, ["PREPROCESSING_CACHE_FOLDER_PATH"])
+    redirect_folder_paths(solution, working_folder_path, ["PREDICTION_STORE_FOLDER_PATH", "SUBMISSION_FOLDER_PATH"])
+    configure_tuning_engine(getattr(XGBoost, "TUNING_ENGINE", None), working_folder_path, quick)
+
+    stage_record_list = []
+    X_train, Y_train, X_test, ID_test = run_stage(stage_record_list, "load_data", file_operations.load_data)
+    run_stage(stage_record_list, "load_data_cached", file_operations.load_data)
+    optimal_parameters = run_stage(stage_record_list, "perform_tuning", XGBoost.perform_tuning, X_train, Y_train)
+
+    def generate_prediction():
+        random_state_list = range(1, prediction_num + 1)
+        if hasattr(XGBoost, "generate_predictions"):
+            prediction_iterator = XGBoost.generate_predictions(X_train, Y_train, X_test, optimal_parameters, random_state_list)
+        else:
+            prediction_iterator = (XGBoost.generate_prediction(X_train, Y_train, X_test, optimal_parameters, random_state=random_state) for random_state in random_state_list)
+
+        if hasattr(file_operations, "append_to_prediction_store"):
+            file_operations.reset_prediction_store(solution.PREDICTION_STORE_FOLDER_PATH, ID_test)
+            for score, prediction in prediction_iterator:
+                file_operations.append_to_prediction_store(solution.PREDICTION_STORE_FOLDER_PATH, score, prediction)
+        else:
+            # Older trees write one submission file per prediction, which is what their ensemble.py reads
+            os.makedirs(solution.SUBMISSION_FOLDER_PATH, exist_ok=True)
+            for prediction_index, (score, prediction) in enumerate(prediction_iterator, start=1):
+                submission_file_name = "Aurora_{:.4f}_{:d}.csv".format(score, prediction_index)
+                file_operations.write_submission(ID_test, prediction, os.path.join(solution.SUBMISSION_FOLDER_PATH, submission_file_name))
+    run_stage(stage_record_list, "generate_prediction", generate_prediction)
+    run_stage(stage_record_list, "ensemble", runpy.run_path, os.path.join(pipeline_folder_path, "ensemble.py"))
+    return stage_record_list
+
+def benchmark_claims_pipeline(pipeline_folder_path, working_folder_path, prediction_num, quick):
+    import fine_tune  # @UnresolvedImport pylint: disable=import-error
+    import preprocessing  # @UnresolvedImport pylint: disable=import-error
+    import solution  # @UnresolvedImport pylint: disable=import-error
+
+    redirect_folder_paths(sys.modules.get("tabular_data"), working_folder_path, ["PREPROCESSING_CACHE_FOLDER_PATH"])
+    redirect_folder_paths(solution, working_folder_path, ["prediction_store_folder_path", "submission_folder_path"])
+    configure_tuning_engine(getattr(fine_tune, "TUNING_ENGINE", None), working_folder_path, quick)
+
+    stage_record_list = []
+    X_train, Y_train, X_test, submission_file_content = run_stage(stage_record_list, "load_data", preprocessing.load_data)
+    run_stage(stage_record_list, "load_data_cached", preprocessing.load_data)
+    optimal_max_depth, optimal_min_child_weight, optimal_subsample, optimal_colsample_bytree = \
+        run_stage(stage_record_list, "perform_tuning", fine_tune.perform_tuning, X_train, Y_train)
+
+    def generate_prediction():
+        estimator = fine_tune.XGBClassifier(max_depth=optimal_max_depth, learning_rate=0.05, n_estimators=1000000,
+                                            min_child_weight=optimal_min_child_weight, subsample=optimal_subsample,
+                                            colsample_bytree=optimal_colsample_bytree, objective=fine_tune.OBJECTIVE)
+        cv_num = max(1, prediction_num // fine_tune.CV_FOLD_NUM)
+        if hasattr(preprocessing, "reset_prediction_store"):
+            preprocessing.reset_prediction_store(solution.prediction_store_folder_path, submission_file_content[preprocessing.ID_COLUMN_NAME].values)
+            solution.generate_prediction(estimator, X_train, Y_train, X_test, early_stopping_rounds=200, cv_num=cv_num)
+        else:
+            # Older trees write one submission file per prediction, which is what their ensemble.py reads
+            os.makedirs(solution.submission_folder_path, exist_ok=True)
+            solution.generate_prediction(estimator, X_train, Y_train, X_test, submission_file_content, early_stopping_rounds=200, cv_num=cv_num)
+    run_stage(stage_record_list, "generate_prediction", generate_prediction)
+    run_stage(stage_record_list, "ensemble", runpy.run_path, os.path.join(pipeline_folder_path, "ensemble.py"))
+    return stage_record_list
+
+def run_worker(repository_folder_path, dataset_name, scale, prediction_num, quick, seed, result_file_path):
+    # Each dataset runs in its own process, so that the module names and the peak RSS do not interfere
+    row_num = max(100, int(DATASET_NAME_TO_ROW_NUM_DICT[dataset_name] * scale))
+    pipeline_folder_path = os.path.join(repository_folder_path, DATASET_NAME_TO_FOLDER_NAME_DICT[dataset_name])
+    working_folder_path = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        print("Generating {} rows of synthetic {} data in {} ...".format(row_num, dataset_name, working_folder_path))
+        write_synthetic_data(dataset_name, row_num, working_folder_path, seed)
+
+        # The modules are imported from the pipeline folder, while the relative paths of the input files and the ensemble outputs point to the working folder
+        os.chdir(working_folder_path)
+        sys.path.insert(0, pipeline_folder_path)
+
+        benchmark_function = benchmark_claims_pipeline if dataset_name == "Claims Management" else benchmark_xgboost_pipeline
+        stage_record_list = benchmark_function(pipeline_folder_path, working_folder_path, prediction_num, quick)
+    finally:
+        os.chdir(repository_folder_path)
+        shutil.rmtree(working_folder_path, ignore_errors=True)
+
+    with open(result_file_path, "w") as result_file_object:
+        json.dump({"row_num": row_num, "stages": stage_record_list}, result_file_object)
+
+def get_commit_id(repository_folder_path):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repository_folder_path, stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(repository_folder_path, dataset_name_list, scale, prediction_num, quick, seed, output_file_path):
+    result_dict = {"repository": repository_folder_path, "commit": get_commit_id(repository_folder_path), "time": str(datetime.datetime.now()).split(".")[0],
+                   "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                   "scale": scale, "prediction_num": prediction_num, "quick": quick, "seed": seed, "datasets": {}}
+    for dataset_name in dataset_name_list:
+        print("Benchmarking {} ...".format(dataset_name))
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as result_file_object:
+            result_file_path = result_file_object.name
+        try:
+            command = [sys.executable, os.path.realpath(__file__), "--worker", dataset_name, "--repository", repository_folder_path, "--scale", str(scale),
+                       "--prediction_num", str(prediction_num), "--seed", str(seed), "--output", result_file_path]
+            if quick:
+                command.append("--quick")
+            return_code = subprocess.call(command)
+            if return_code == 0:
+                with open(result_file_path) as result_file_object:
+                    result_dict["datasets"][dataset_name] = json.load(result_file_object)
+            else:
+                result_dict["datasets"][dataset_name] = {"error": "worker exited with code {}".format(return_code)}
+        finally:
+            os.remove(result_file_path)
+
+    with open(output_file_path, "w") as output_file_object:
+        json.dump(result_dict, output_file_object, indent=2, sort_keys=True)
+    print("Benchmark results saved to {}".format(output_file_path))
+
+def compare_results(baseline_file_path, candidate_file_path):
+    with open(baseline_file_path) as baseline_file_object:
+        baseline_result_dict = json.load(baseline_file_object)
+    with open(candidate_file_path) as candidate_file_object:
+        candidate_result_dict = json.load(candidate_file_object)
+
+    print("Comparing {} with {} ...".format(candidate_result_dict.get("commit"), baseline_result_dict.get("commit")))
+    print("{:<24}{:<22}{:>12}{:>12}{:>9}{:>12}{:>12}{:>9}".format("dataset", "stage", "base s", "cand s", "ratio", "base MB", "cand MB", "ratio"))
+    for dataset_name, candidate_dataset_dict in sorted(candidate_result_dict["datasets"].items()):
+        baseline_dataset_dict = baseline_result_dict["datasets"].get(dataset_name, {})
+        baseline_stage_dict = {stage_record["stage"]: stage_record for stage_record in baseline_dataset_dict.get("stages", [])}
+        for candidate_stage_record in candidate_dataset_dict.get("stages", []):
+            baseline_stage_record = baseline_stage_dict.get(candidate_stage_record["stage"])
+            if baseline_stage_record is None:
+                continue
+            print("{:<24}{:<22}{:>12.2f}{:>12.2f}{:>9.2f}{:>12.1f}{:>12.1f}{:>9.2f}".format(
+                dataset_name, candidate_stage_record["stage"],
+                baseline_stage_record["wall_time"], candidate_stage_record["wall_time"],
+                candidate_stage_record["wall_time"] / max(baseline_stage_record["wall_time"], 1e-9),
+                baseline_stage_record["peak_rss_MB"], candidate_stage_record["peak_rss_MB"],
+                candidate_stage_record["peak_rss_MB"] / max(baseline_stage_record["peak_rss_MB"], 1e-9)))
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark the shared tabular pipeline on synthetic data.")
+    parser.add_argument("--dataset", action="append", choices=sorted(DATASET_NAME_TO_FOLDER_NAME_DICT.keys()),
+                        help="Dataset to benchmark, may be repeated. All datasets are benchmarked by default.")
+    parser.add_argument("--repository", type=str, default=REPOSITORY_FOLDER_PATH, help="Checkout which contains the pipelines, e.g., a worktree of the baseline commit.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor applied to the default number of rows.")
+    parser.add_argument("--prediction_num", type=int, default=10, help="Number of predictions to generate and ensemble.")
+    parser.add_argument("--quick", action="store_true", help="Only tune the first two values of each search space.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data.")
+    parser.add_argument("--output", type=str, default="benchmark_{}.json".format(time.strftime("%Y%m%d_%H%M%S")), help="Path of the JSON results.")
+    parser.add_argument("--compare", type=str, nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two JSON results and exit.")
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare_results(*args.compare)
+    elif args.worker is not None:
+        run_worker(os.path.abspath(args.repository), args.worker, args.scale, args.prediction_num, args.quick, args.seed, args.output)
+    else:
+        dataset_name_list = args.dataset or sorted(DATASET_NAME_TO_FOLDER_NAME_DICT.keys())
+        run_benchmark(os.path.abspath(args.repository), dataset_name_list, args.scale, args.prediction_num, args.quick, args.seed, os.path.abspath(args.output))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,26 @@
+import resource
+
+PROC_STATUS_FILE_PATH = "/proc/self/status"
+PROC_CLEAR_REFS_FILE_PATH = "/proc/self/clear_refs"
+
+def read_memory_status_in_MB():
+    # Returns the current RSS and the peak RSS, the latter falls back to ru_maxrss outside Linux
+    memory_status_dict = {}
+    try:
+        with open(PROC_STATUS_FILE_PATH) as status_file_object:
+            for line in status_file_object:
+                if line.startswith("VmRSS:") or line.startswith("VmHWM:"):
+                    memory_status_dict[line.split(":")[0]] = int(line.split()[1]) / 1024
+    except (IOError, OSError):
+        pass
+    peak_rss = memory_status_dict.get("VmHWM", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    return memory_status_dict.get("VmRSS", peak_rss), peak_rss
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM on Linux 4.0+, so that each stage gets its own peak
+    try:
+        with open(PROC_CLEAR_REFS_FILE_PATH, "w") as clear_refs_file_object:
+            clear_refs_file_object.write("5")
+        return True
+    except (IOError, OSError):
+        return False
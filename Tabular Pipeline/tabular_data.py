@@ -0,0 +1,158 @@
+from scipy import sparse
+from sklearn.preprocessing import OneHotEncoder
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import shutil
+
+# The preprocessed arrays are cached in memory-mappable files, keyed by the input files and the preprocessing code
+PREPROCESSING_CACHE_FOLDER_PATH = "/tmp/preprocessing_cache"
+ARRAY_NAME_LIST = ["X_train", "Y_train", "X_test", "ID_test"]
+
+# The predictions of all the runs are appended to one binary file, and their scores to a small index
+PREDICTION_DTYPE = np.float64
+
+# Keep the one-hot encoded features as a CSR matrix instead of densifying them
+SPARSE_MODE = False
+
+NUMERICAL_INFERRED_TYPE_LIST = ["integer", "floating", "mixed-integer-float", "decimal", "boolean"]
+
+def is_categorical_column(column_series):
+    if pd.api.types.is_numeric_dtype(column_series.dtype):
+        return False
+    return pd.api.types.infer_dtype(column_series.dropna()) not in NUMERICAL_INFERRED_TYPE_LIST
+
+def get_feature_matrix(feature_file_content):
+    # Infer the schema once and fill a numerical matrix column by column, so that no object matrix is created
+    categorical_features_mask_list = [is_categorical_column(feature_file_content[column_name]) for column_name in feature_file_content.columns]
+    X = np.empty(feature_file_content.shape, dtype=np.float64)
+    for column_index, (column_name, is_categorical) in enumerate(zip(feature_file_content.columns, categorical_features_mask_list)):
+        column_series = feature_file_content[column_name]
+        if is_categorical:
+            # The codes follow the sorted order of the values, which is consistent with LabelEncoder
+            X[:, column_index] = pd.factorize(column_series.fillna("Missing"), sort=True)[0]
+        else:
+            column_series = column_series.astype(np.float64)
+            X[:, column_index] = column_series.fillna(column_series.min() - 1).values
+    return X, categorical_features_mask_list
+
+def get_sparse_feature_matrix(X, one_hot_column_num):
+    # XGBoost reads the entries absent from a sparse matrix as missing values, so only the one-hot block keeps implicit zeros,
+    # and the zeros of the numerical columns after it are stored explicitly
+    X = sparse.csc_matrix(X)
+    numerical_array = X[:, one_hot_column_num:].toarray()
+    row_num, numerical_column_num = numerical_array.shape
+    numerical_matrix = sparse.csc_matrix((numerical_array.ravel(order="F"), np.tile(np.arange(row_num), numerical_column_num),
+                                          np.arange(numerical_column_num + 1) * row_num), shape=numerical_array.shape)
+    return sparse.hstack([X[:, :one_hot_column_num], numerical_matrix], format="csc").tocsr()
+
+def get_one_hot_feature_matrix(feature_file_content, sparse_mode=SPARSE_MODE):
+    X, categorical_features_mask_list = get_feature_matrix(feature_file_content)
+    encoder = OneHotEncoder(categorical_features=categorical_features_mask_list)
+    X = encoder.fit_transform(X)
+    if not sparse_mode:
+        return X.toarray(), encoder
+
+    # OneHotEncoder puts the one-hot block first and the numerical columns after it
+    one_hot_column_num = X.shape[1] - (len(categorical_features_mask_list) - sum(categorical_features_mask_list))
+    return get_sparse_feature_matrix(X, one_hot_column_num), encoder
+
+def get_preprocessing_cache_folder_path(file_path_list):
+    # The key covers the given files, i.e., the input files and the preprocessing code, together with this module
+    hash_object = hashlib.sha1()
+    for file_path in list(file_path_list) + [os.path.realpath(__file__)]:
+        with open(file_path, "rb") as file_object:
+            for chunk in iter(lambda: file_object.read(2 ** 24), b""):
+                hash_object.update(chunk)
+    return os.path.join(PREPROCESSING_CACHE_FOLDER_PATH, hash_object.hexdigest())
+
+def write_array(data_array, file_path_prefix):
+    if sparse.issparse(data_array):
+        data_array = data_array.tocsr()
+        for component_name in ["data", "indices", "indptr"]:
+            np.save("{}_{}.npy".format(file_path_prefix, component_name), getattr(data_array, component_name))
+        np.save("{}_shape.npy".format(file_path_prefix), np.array(data_array.shape))
+    else:
+        np.save("{}.npy".format(file_path_prefix), data_array)
+
+def read_array(file_path_prefix):
+    if os.path.isfile("{}_shape.npy".format(file_path_prefix)):
+        component_tuple = tuple(np.load("{}_{}.npy".format(file_path_prefix, component_name), mmap_mode="r") for component_name in ["data", "indices", "indptr"])
+        return sparse.csr_matrix(component_tuple, shape=tuple(np.load("{}_shape.npy".format(file_path_prefix))))
+    try:
+        return np.load("{}.npy".format(file_path_prefix), mmap_mode="r")
+    except ValueError:
+        # Arrays of Python objects cannot be memory-mapped
+        return np.load("{}.npy".format(file_path_prefix), allow_pickle=True)
+
+def write_preprocessing_cache(cache_folder_path, array_list, encoder_dict):
+    # Write to a temporary folder first so that other processes never see a partial cache
+    temporary_folder_path = "{}.{}.tmp".format(cache_folder_path, os.getpid())
+    os.makedirs(temporary_folder_path)
+    for array_name, data_array in zip(ARRAY_NAME_LIST, array_list):
+        write_array(data_array, os.path.join(temporary_folder_path, array_name))
+    with open(os.path.join(temporary_folder_path, "encoder_dict.pkl"), "wb") as encoder_file_object:
+        pickle.dump(encoder_dict, encoder_file_object)
+    try:
+        os.rename(temporary_folder_path, cache_folder_path)
+    except OSError:
+        # Another process has written the same cache in the meantime
+        shutil.rmtree(temporary_folder_path, ignore_errors=True)
+
+def read_preprocessing_cache(cache_folder_path):
+    array_list = [read_array(os.path.join(cache_folder_path, array_name)) for array_name in ARRAY_NAME_LIST]
+    with open(os.path.join(cache_folder_path, "encoder_dict.pkl"), "rb") as encoder_file_object:
+        encoder_dict = pickle.load(encoder_file_object)
+    return array_list, encoder_dict
+
+def load_preprocessed_data(perform_preprocessing, file_path_list):
+    # perform_preprocessing returns X_train, Y_train, X_test, ID_test and a dict of the fitted encoders
+    cache_folder_path = get_preprocessing_cache_folder_path(file_path_list)
+    if os.path.isdir(cache_folder_path):
+        print("Loading preprocessed data from {:s} ...".format(cache_folder_path))
+        return read_preprocessing_cache(cache_folder_path)
+
+    preprocessing_result = perform_preprocessing()
+    array_list, encoder_dict = list(preprocessing_result[:-1]), preprocessing_result[-1]
+    print("Saving preprocessed data to {:s} ...".format(cache_folder_path))
+    write_preprocessing_cache(cache_folder_path, array_list, encoder_dict)
+    return array_list, encoder_dict
+
+def reset_prediction_store(store_folder_path, ID_test):
+    shutil.rmtree(store_folder_path, ignore_errors=True)
+    os.makedirs(store_folder_path)
+    np.save(os.path.join(store_folder_path, "ID_test.npy"), ID_test)
+
+def append_to_prediction_store(store_folder_path, score, prediction):
+    prediction = np.ascontiguousarray(prediction, dtype=PREDICTION_DTYPE)
+    row_shape_file_path = os.path.join(store_folder_path, "row_shape.json")
+    if not os.path.isfile(row_shape_file_path):
+        with open(row_shape_file_path, "w") as row_shape_file_object:
+            json.dump(prediction.shape, row_shape_file_object)
+
+    # The index is the source of truth, i.e., an interrupted append may leave an orphan row behind,
+    # so predictions.bin is truncated to the rows in the index before the new row is written
+    index_file_path = os.path.join(store_folder_path, "index.txt")
+    row_num = 0
+    if os.path.isfile(index_file_path):
+        with open(index_file_path) as index_file_object:
+            row_num = sum(1 for _ in index_file_object)
+    with open(os.path.join(store_folder_path, "predictions.bin"), "ab") as prediction_file_object:
+        prediction_file_object.truncate(row_num * prediction.nbytes)
+        prediction_file_object.write(prediction.tobytes())
+
+    with open(index_file_path, "a") as index_file_object:
+        index_file_object.write("{!r}\n".format(float(score)))
+
+def load_prediction_store(store_folder_path):
+    ID_test = np.load(os.path.join(store_folder_path, "ID_test.npy"), allow_pickle=True)
+    with open(os.path.join(store_folder_path, "index.txt")) as index_file_object:
+        score_array = np.array([float(line) for line in index_file_object], dtype=np.float64)
+    with open(os.path.join(store_folder_path, "row_shape.json")) as row_shape_file_object:
+        row_shape = tuple(json.load(row_shape_file_object))
+    prediction_array = np.memmap(os.path.join(store_folder_path, "predictions.bin"), dtype=PREDICTION_DTYPE, mode="r",
+                                 shape=(len(score_array),) + row_shape)
+    return ID_test, score_array, prediction_array
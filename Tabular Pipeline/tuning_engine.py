@@ -0,0 +1,286 @@
+from multiprocessing import Pool, get_context
+from scipy import sparse
+from sklearn.cross_validation import StratifiedKFold, StratifiedShuffleSplit
+from xgboost.sklearn import XGBClassifier
+import hashlib
+import json
+import numpy as np
+import os
+import xgboost as xgb
+
+# Tuning engine: candidate x fold jobs run on a process pool and each result is memoized on disk
+PROCESS_NUM = os.cpu_count()
+TUNING_CACHE_FOLDER_PATH = "/tmp/tuning_cache"
+TUNING_LEARNING_RATE = 0.1
+N_ESTIMATORS = 1000000
+PARAMETER_NAME_LIST = ["max_depth", "min_child_weight", "subsample", "colsample_bytree"]
+INITIAL_PARAMETERS = {"min_child_weight": 5, "subsample": 0.8, "colsample_bytree": 0.8}
+SEARCH_SPACE_LIST = [("max_depth", np.linspace(4, 14, num=6, dtype=np.int)),
+                     ("subsample", np.linspace(0.6, 1, num=5)),
+                     ("min_child_weight", np.linspace(1, 9, num=5)),
+                     ("colsample_bytree", np.linspace(0.6, 1, num=5))]
+
+# Racing mode: candidates are scored on a growing number of folds and those statistically behind the leader are dropped
+RACING_MODE = False
+RACING_MIN_FOLD_NUM = 3
+RACING_Z_SCORE = 2.0
+# Lower bound of the standard deviation of the paired differences, so that a few identical folds cannot abort a candidate
+RACING_MIN_STD = 1e-3
+
+# Features are quantized to float32 once, which is what XGBoost uses internally anyway
+FEATURE_DTYPE = np.float32
+
+# Predict with the early-stopped booster instead of training again with best_iteration rounds
+TRAIN_ONCE = True
+
+# Train the boosters of generate_predictions in a pool of single-threaded workers instead of one multi-threaded booster at a time
+PARALLEL_PREDICTION = True
+
+# Shared by the worker processes of the tuning engine
+WORKER_STATE = {}
+
+def get_fold_matrices(X_train, Y_train, train_indexes, validate_indexes):
+    # Only NaN is missing, so that the zeros stored explicitly in a sparse matrix remain zeros
+    train_matrix = xgb.DMatrix(X_train[train_indexes], label=Y_train[train_indexes], missing=np.nan)
+    validate_matrix = xgb.DMatrix(X_train[validate_indexes], label=Y_train[validate_indexes], missing=np.nan)
+    return train_matrix, validate_matrix
+
+def predict_proba(booster, test_matrix, ntree_limit=0):
+    # Match the layout of XGBClassifier.predict_proba
+    proba = booster.predict(test_matrix, ntree_limit=ntree_limit)
+    if proba.ndim == 1:
+        proba = np.vstack([1 - proba, proba]).T
+    return proba
+
+def get_job_file_name(parameters, cv_index, fold_index):
+    job_description = json.dumps({"parameters": {key: float(value) for key, value in parameters.items()},
+                                  "cv_index": cv_index, "fold_index": fold_index}, sort_keys=True)
+    return hashlib.sha1(job_description.encode("utf-8")).hexdigest() + ".txt"
+
+class TuningEngine(object):
+    # Coordinate descent over the search spaces, configured with the objective, the metric and the folds of each competition
+
+    def __init__(self, objective, eval_metric, get_best_score_index, fold_num, cv_num=1, early_stopping_rounds=100,
+                 search_space_list=SEARCH_SPACE_LIST, initial_parameters=INITIAL_PARAMETERS, racing_mode=RACING_MODE,
+                 tuning_cache_folder_path=TUNING_CACHE_FOLDER_PATH, process_num=PROCESS_NUM):
+        self.objective = objective
+        self.eval_metric = eval_metric
+        self.get_best_score_index = get_best_score_index
+        self.score_direction = 1 if get_best_score_index([0, 1]) == 0 else -1
+        self.fold_num = fold_num
+        self.cv_num = cv_num
+        self.early_stopping_rounds = early_stopping_rounds
+        self.search_space_list = search_space_list
+        self.initial_parameters = initial_parameters
+        self.racing_mode = racing_mode
+        self.tuning_cache_folder_path = tuning_cache_folder_path
+        self.process_num = process_num
+
+    def get_cv_fold_list(self, Y_train):
+        cv_fold_list = []
+        for cv_index in range(self.cv_num):
+            cv_object = StratifiedKFold(Y_train, n_folds=self.fold_num, shuffle=True, random_state=cv_index)
+            for fold_index, (train_indexes, validate_indexes) in enumerate(cv_object):
+                cv_fold_list.append((cv_index, fold_index, train_indexes, validate_indexes))
+        return cv_fold_list
+
+    def get_fold_matrix_list(self, X_train, Y_train):
+        X_train = X_train.astype(FEATURE_DTYPE, copy=False)
+        return [get_fold_matrices(X_train, Y_train, train_indexes, validate_indexes) for _, _, train_indexes, validate_indexes in self.get_cv_fold_list(Y_train)]
+
+    def get_estimator(self, parameters, learning_rate=TUNING_LEARNING_RATE, nthread=-1):
+        return XGBClassifier(max_depth=parameters["max_depth"], learning_rate=learning_rate, n_estimators=N_ESTIMATORS,
+                             min_child_weight=parameters["min_child_weight"], subsample=parameters["subsample"],
+                             colsample_bytree=parameters["colsample_bytree"], objective=self.objective, nthread=nthread)
+
+    def get_booster_params(self, estimator, train_matrix):
+        booster_params = estimator.get_xgb_params()
+        booster_params.pop("n_estimators", None)
+        booster_params["eval_metric"] = self.eval_metric
+        if self.objective.startswith("multi:"):
+            booster_params["num_class"] = int(np.max(train_matrix.get_label())) + 1
+        return booster_params
+
+    def train_booster(self, estimator, train_matrix, validate_matrix, early_stopping_rounds):
+        return xgb.train(self.get_booster_params(estimator, train_matrix), train_matrix, num_boost_round=estimator.n_estimators,
+                         evals=[(validate_matrix, "validate")], early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+
+    def evaluate_fold(self, estimator, train_matrix, validate_matrix, early_stopping_rounds=None):
+        early_stopping_rounds = self.early_stopping_rounds if early_stopping_rounds is None else early_stopping_rounds
+        booster = self.train_booster(estimator, train_matrix, validate_matrix, early_stopping_rounds)
+        return booster.best_iteration, booster.best_score
+
+    def is_statistically_behind(self, best_score_list, reference_best_score_list):
+        fold_num = len(best_score_list)
+        if fold_num < RACING_MIN_FOLD_NUM:
+            return False
+
+        # Paired differences on the shared folds, oriented so that a positive gap means worse
+        difference_array = self.score_direction * (np.array(best_score_list) - np.array(reference_best_score_list[:fold_num]))
+        gap = np.mean(difference_array)
+        standard_error = max(np.std(difference_array, ddof=1), RACING_MIN_STD) / np.sqrt(fold_num)
+        return gap > 0 and gap > RACING_Z_SCORE * standard_error
+
+    def get_worst_score(self):
+        # Aborted candidates get the worst possible score so that they can never be selected
+        return self.score_direction * np.inf
+
+    def evaluate_estimator(self, estimator, X_train, Y_train, reference_best_score_list=None, fold_matrix_list=None):
+        if fold_matrix_list is None:
+            fold_matrix_list = self.get_fold_matrix_list(X_train, Y_train)
+
+        best_score_list = []
+        for train_matrix, validate_matrix in fold_matrix_list:
+            best_score_list.append(self.evaluate_fold(estimator, train_matrix, validate_matrix)[1])
+            if reference_best_score_list is not None and self.is_statistically_behind(best_score_list, reference_best_score_list):
+                print("Early abort after {:d} folds since the estimator is behind the reference.".format(len(best_score_list)))
+                return self.get_worst_score()
+
+        print("The median best_score is {:.4f}.".format(np.median(best_score_list)))
+        return np.median(best_score_list)
+
+    def get_data_fingerprint(self, X_train, Y_train):
+        hash_object = hashlib.sha1()
+        for data_array in [X_train, Y_train]:
+            hash_object.update(str((data_array.shape, data_array.dtype.str)).encode("utf-8"))
+            if sparse.issparse(data_array):
+                data_array = data_array.tocsr()
+                for component_array in [data_array.data, data_array.indices, data_array.indptr]:
+                    hash_object.update(np.ascontiguousarray(component_array).tobytes())
+            else:
+                hash_object.update(np.ascontiguousarray(data_array).tobytes())
+        hash_object.update(str((self.fold_num, self.cv_num, self.eval_metric, self.early_stopping_rounds, self.objective)).encode("utf-8"))
+        return hash_object.hexdigest()
+
+    def get_racing_schedule(self, fold_num):
+        if not self.racing_mode:
+            return [fold_num]
+
+        racing_schedule = []
+        racing_fold_num = RACING_MIN_FOLD_NUM
+        while racing_fold_num < fold_num:
+            racing_schedule.append(racing_fold_num)
+            racing_fold_num *= 2
+        racing_schedule.append(fold_num)
+        return racing_schedule
+
+    def evaluate_candidates(self, pool, parameters_list, fold_num):
+        best_score_array = np.full((len(parameters_list), fold_num), np.nan)
+        survivor_mask = np.ones(len(parameters_list), dtype=bool)
+        evaluated_fold_num = 0
+        for racing_fold_num in self.get_racing_schedule(fold_num):
+            survivor_indexes = np.flatnonzero(survivor_mask)
+            fold_positions = np.arange(evaluated_fold_num, racing_fold_num)
+            job_list = [(parameters_list[survivor_index], fold_position) for survivor_index in survivor_indexes for fold_position in fold_positions]
+            best_score_array[np.ix_(survivor_indexes, fold_positions)] = np.array(pool.map(run_tuning_job, job_list)).reshape(len(survivor_indexes), len(fold_positions))
+            evaluated_fold_num = racing_fold_num
+            if evaluated_fold_num == fold_num:
+                break
+
+            # Drop the candidates which are statistically behind the current leader
+            leader_index = survivor_indexes[self.get_best_score_index(np.mean(best_score_array[survivor_indexes, :evaluated_fold_num], axis=1))]
+            for survivor_index in survivor_indexes:
+                if survivor_index != leader_index and self.is_statistically_behind(best_score_array[survivor_index, :evaluated_fold_num],
+                                                                                   best_score_array[leader_index, :evaluated_fold_num]):
+                    survivor_mask[survivor_index] = False
+
+        median_best_score_array = np.array([np.median(best_score_vector[np.logical_not(np.isnan(best_score_vector))]) for best_score_vector in best_score_array])
+        for median_best_score, survivor_flag, best_score_vector in zip(median_best_score_array, survivor_mask, best_score_array):
+            if survivor_flag:
+                print("The median best_score is {:.4f}.".format(median_best_score))
+            else:
+                print("The median best_score is {:.4f} (dropped after {:d} folds).".format(median_best_score, np.sum(np.logical_not(np.isnan(best_score_vector)))))
+        return median_best_score_array, survivor_mask
+
+    def perform_tuning(self, X_train, Y_train):
+        cache_folder_path = os.path.join(self.tuning_cache_folder_path, self.get_data_fingerprint(X_train, Y_train))
+        os.makedirs(cache_folder_path, exist_ok=True)
+        print("Tuning results are cached in {:s}.".format(cache_folder_path))
+
+        # The fold matrices are built once in this process before the pool is forked, so that the workers inherit them
+        # instead of building their own copies, and the memory usage does not grow with the number of workers
+        cv_fold_list = self.get_cv_fold_list(Y_train)
+        X_train = X_train.astype(FEATURE_DTYPE, copy=False)
+        WORKER_STATE.update(tuning_engine=self, cv_fold_list=cv_fold_list, cache_folder_path=cache_folder_path,
+                            fold_matrix_list=[get_fold_matrices(X_train, Y_train, train_indexes, validate_indexes) for _, _, train_indexes, validate_indexes in cv_fold_list])
+        optimal_parameters_dict = dict(self.initial_parameters)
+        try:
+            with get_context("fork").Pool(processes=self.process_num) as pool:
+                for parameter_name, search_space in self.search_space_list:
+                    print("Tuning {:s} ...".format(parameter_name))
+                    parameters_list = [dict(optimal_parameters_dict, **{parameter_name: value}) for value in search_space]
+                    best_score_list, survivor_mask = self.evaluate_candidates(pool, parameters_list, len(cv_fold_list))
+                    survivor_indexes = np.flatnonzero(survivor_mask)
+                    best_score_index = survivor_indexes[self.get_best_score_index(best_score_list[survivor_indexes])]
+                    optimal_parameters_dict[parameter_name] = search_space[best_score_index]
+                    print("The optimal {:s} is {}.".format(parameter_name, optimal_parameters_dict[parameter_name]))
+        finally:
+            WORKER_STATE.clear()
+
+        optimal_parameters = [optimal_parameters_dict[parameter_name] for parameter_name in PARAMETER_NAME_LIST]
+        print("The optimal parameters are as follows:")
+        print(optimal_parameters)
+        return optimal_parameters
+
+    def generate_prediction(self, X_train, Y_train, X_test, optimal_parameters, learning_rate, train_size=None, random_state=0, nthread=-1):
+        optimal_estimator = self.get_estimator(dict(zip(PARAMETER_NAME_LIST, optimal_parameters)), learning_rate, nthread)
+        train_size = (self.fold_num - 1) / self.fold_num if train_size is None else train_size
+
+        X_train = X_train.astype(FEATURE_DTYPE, copy=False)
+        test_matrix = X_test if isinstance(X_test, xgb.DMatrix) else xgb.DMatrix(X_test.astype(FEATURE_DTYPE, copy=False), missing=np.nan)
+        cv_object = StratifiedShuffleSplit(Y_train, n_iter=1, train_size=train_size, random_state=random_state)
+        for train_indexes, validate_indexes in cv_object:
+            train_matrix, validate_matrix = get_fold_matrices(X_train, Y_train, train_indexes, validate_indexes)
+
+            booster = self.train_booster(optimal_estimator, train_matrix, validate_matrix, 2 * self.early_stopping_rounds)
+            best_score = booster.best_score
+            best_iteration = booster.best_iteration
+
+            if TRAIN_ONCE:
+                proba = predict_proba(booster, test_matrix, ntree_limit=booster.best_ntree_limit)
+            else:
+                booster = xgb.train(self.get_booster_params(optimal_estimator, train_matrix), train_matrix, num_boost_round=best_iteration)
+                proba = predict_proba(booster, test_matrix)
+            return best_score, proba[:, 1]
+
+    def generate_predictions(self, X_train, Y_train, X_test, optimal_parameters, learning_rate, random_state_list):
+        # Yield the (best_score, prediction) pairs in the order of random_state_list
+        if not PARALLEL_PREDICTION:
+            for random_state in random_state_list:
+                yield self.generate_prediction(X_train, Y_train, X_test, optimal_parameters, learning_rate, random_state=random_state)
+            return
+
+        with Pool(processes=self.process_num, initializer=initialize_prediction_worker,
+                  initargs=(self, X_train, Y_train, X_test, optimal_parameters, learning_rate)) as pool:
+            for best_score, prediction in pool.imap(run_prediction_job, random_state_list):
+                yield best_score, prediction
+
+def run_tuning_job(job):
+    parameters, fold_position = job
+    cv_index, fold_index, _, _ = WORKER_STATE["cv_fold_list"][fold_position]
+    cache_file_path = os.path.join(WORKER_STATE["cache_folder_path"], get_job_file_name(parameters, cv_index, fold_index))
+    if os.path.isfile(cache_file_path):
+        with open(cache_file_path) as cache_file_object:
+            return float(cache_file_object.read())
+
+    # Parallelism comes from the process pool, so each estimator sticks to one thread
+    tuning_engine = WORKER_STATE["tuning_engine"]
+    _, best_score = tuning_engine.evaluate_fold(tuning_engine.get_estimator(parameters, nthread=1), *WORKER_STATE["fold_matrix_list"][fold_position])
+
+    # Write to a temporary file first so that an interrupted run never leaves a truncated entry behind
+    temporary_file_path = "{}.{}.tmp".format(cache_file_path, os.getpid())
+    with open(temporary_file_path, "w") as temporary_file_object:
+        temporary_file_object.write(repr(float(best_score)))
+    os.replace(temporary_file_path, cache_file_path)
+    return best_score
+
+def initialize_prediction_worker(tuning_engine, X_train, Y_train, X_test, optimal_parameters, learning_rate):
+    WORKER_STATE.update(tuning_engine=tuning_engine, X_train=X_train.astype(FEATURE_DTYPE, copy=False), Y_train=Y_train,
+                        test_matrix=xgb.DMatrix(X_test.astype(FEATURE_DTYPE, copy=False), missing=np.nan), optimal_parameters=optimal_parameters,
+                        learning_rate=learning_rate)
+
+def run_prediction_job(random_state):
+    # Parallelism comes from the process pool, so each estimator sticks to one thread
+    return WORKER_STATE["tuning_engine"].generate_prediction(WORKER_STATE["X_train"], WORKER_STATE["Y_train"], WORKER_STATE["test_matrix"],
+                                                             WORKER_STATE["optimal_parameters"], WORKER_STATE["learning_rate"],
+                                                             random_state=random_state, nthread=1)
@@ -0,0 +1,52 @@
+import numpy as np
+
+# Each categorical feature is remapped to dense codes which are ordered by frequency,
+# and the values beyond the cap or below the minimum count share the rare bucket
+CATEGORICAL_FEATURE_LIST = ["ip", "app", "device", "os", "channel"]
+MAX_CATEGORY_NUM = 4095
+MIN_CATEGORY_COUNT = 10
+
+def update_category_counts(count_dict, data_df, column_name_list=CATEGORICAL_FEATURE_LIST):
+    # The counts of each chunk are added up, so that the encoders are fitted without holding a whole column in memory
+    for column_name in column_name_list:
+        chunk_count_array = np.bincount(data_df[column_name].values.astype(np.int64, copy=False))
+        count_array = count_dict.get(column_name, np.zeros(0, dtype=np.int64))
+        if len(chunk_count_array) > len(count_array):
+            count_array = np.pad(count_array, (0, len(chunk_count_array) - len(count_array)), mode="constant")
+        count_array[:len(chunk_count_array)] += chunk_count_array
+        count_dict[column_name] = count_array
+    return count_dict
+
+def fit_encoder(value_array, max_category_num=MAX_CATEGORY_NUM, min_category_count=MIN_CATEGORY_COUNT):
+    return fit_encoder_from_counts(np.bincount(value_array.astype(np.int64, copy=False)), max_category_num, min_category_count)
+
+def fit_encoder_from_counts(count_array, max_category_num=MAX_CATEGORY_NUM, min_category_count=MIN_CATEGORY_COUNT):
+    # The most frequent value gets code 0, and ties are broken by value so that the encoder is deterministic
+    frequent_value_array = np.argsort(-count_array, kind="mergesort")[:max_category_num]
+    frequent_value_array = frequent_value_array[count_array[frequent_value_array] >= min_category_count]
+
+    # The last entry of the lookup table is the rare bucket, which also covers the values larger than any value seen during fitting
+    rare_code = len(frequent_value_array)
+    code_dtype = np.min_scalar_type(rare_code)
+    lookup_array = np.full(len(count_array) + 1, rare_code, dtype=code_dtype)
+    lookup_array[frequent_value_array] = np.arange(rare_code, dtype=code_dtype)
+    return lookup_array
+
+def fit_encoders(data_df, column_name_list=CATEGORICAL_FEATURE_LIST, max_category_num=MAX_CATEGORY_NUM, min_category_count=MIN_CATEGORY_COUNT):
+    return {column_name: fit_encoder(data_df[column_name].values, max_category_num, min_category_count) for column_name in column_name_list}
+
+def encode(value_array, lookup_array):
+    return lookup_array[np.minimum(value_array.astype(np.int64, copy=False), len(lookup_array) - 1)]
+
+def transform(data_df, encoder_dict):
+    for column_name, lookup_array in encoder_dict.items():
+        if column_name in data_df.columns:
+            data_df[column_name] = encode(data_df[column_name].values, lookup_array)
+    return data_df
+
+def save_encoders(encoder_dict, file_path):
+    np.savez(file_path, **encoder_dict)
+
+def load_encoders(file_path):
+    with np.load(file_path) as encoder_file_object:
+        return {column_name: encoder_file_object[column_name] for column_name in encoder_file_object.files}
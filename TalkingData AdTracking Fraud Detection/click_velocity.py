@@ -0,0 +1,142 @@
+import numpy as np
+import group_features
+
+# Click velocity features are computed for each of the following keys
+VELOCITY_KEY_LIST = [["ip", "app", "device", "os"], ["ip", "os", "device"], ["ip", "app", "device", "os", "channel"]]
+TIMESTAMP_COLUMN_NAME = "timestamp"
+WINDOW_LENGTH_LIST = [60, 3600]  # In seconds
+RING_BUFFER_SIZE = 64  # Rolling counts are capped at this value, in both batch mode and stream mode
+DELTA_DTYPE = np.float32
+COUNT_DTYPE = np.uint16
+
+def get_feature_name_list(column_name_list, include_next_click=True):
+    key_name = "_".join(column_name_list)
+    feature_name_list = ["prev_click_{}".format(key_name)]
+    if include_next_click:
+        feature_name_list.append("next_click_{}".format(key_name))
+    feature_name_list += ["click_count_{}s_{}".format(window_length, key_name) for window_length in WINDOW_LENGTH_LIST]
+    return feature_name_list
+
+def get_sorted_groups(data_df, column_name_list):
+    # Sort by key and then by time, and keep the original order of the clicks with the same timestamp
+    group_index_array, _ = group_features.encode_group_key(data_df, column_name_list)
+    timestamp_array = data_df[TIMESTAMP_COLUMN_NAME].values.astype(np.int64)
+    composite_key_array = (group_index_array.astype(np.int64) << 32) | timestamp_array
+    sorted_indexes = np.argsort(composite_key_array, kind="mergesort")
+    sorted_composite_key_array = composite_key_array[sorted_indexes]
+    sorted_group_index_array = group_index_array[sorted_indexes]
+    is_same_group_array = sorted_group_index_array[1:] == sorted_group_index_array[:-1]
+    return sorted_indexes, sorted_composite_key_array, is_same_group_array
+
+def compute_velocity_features(data_df, column_name_list, include_next_click=True):
+    sorted_indexes, sorted_composite_key_array, is_same_group_array = get_sorted_groups(data_df, column_name_list)
+    sorted_timestamp_array = data_df[TIMESTAMP_COLUMN_NAME].values[sorted_indexes].astype(np.int64)
+    delta_array = np.diff(sorted_timestamp_array).astype(DELTA_DTYPE)
+    delta_array[~is_same_group_array] = np.nan
+
+    sorted_feature_array_list = []
+    prev_click_array = np.full(len(sorted_indexes), np.nan, dtype=DELTA_DTYPE)
+    prev_click_array[1:] = delta_array
+    sorted_feature_array_list.append(prev_click_array)
+    if include_next_click:
+        next_click_array = np.full(len(sorted_indexes), np.nan, dtype=DELTA_DTYPE)
+        next_click_array[:-1] = delta_array
+        sorted_feature_array_list.append(next_click_array)
+    for window_length in WINDOW_LENGTH_LIST:
+        # The clicks of the same key within (timestamp - window_length, timestamp] form a contiguous block
+        start_index_array = np.searchsorted(sorted_composite_key_array, sorted_composite_key_array - window_length, side="right")
+        click_count_array = np.arange(1, len(sorted_indexes) + 1) - start_index_array
+        sorted_feature_array_list.append(np.minimum(click_count_array, RING_BUFFER_SIZE).astype(COUNT_DTYPE))
+
+    feature_array_list = []
+    for sorted_feature_array in sorted_feature_array_list:
+        feature_array = np.empty_like(sorted_feature_array)
+        feature_array[sorted_indexes] = sorted_feature_array
+        feature_array_list.append(feature_array)
+    return dict(zip(get_feature_name_list(column_name_list, include_next_click), feature_array_list))
+
+def add_click_velocity_features(data_df, velocity_key_list=VELOCITY_KEY_LIST, include_next_click=True):
+    for column_name_list in velocity_key_list:
+        print("Computing click velocity features of {} ...".format("-".join(column_name_list)))
+        for feature_name, feature_array in compute_velocity_features(data_df, column_name_list, include_next_click).items():
+            data_df[feature_name] = feature_array
+    return data_df
+
+class ClickVelocityState(object):
+    # Keeps the timestamps of the latest clicks of each key in a ring buffer, so that a live click stream
+    # produces the same prev_click and click_count features as the batch computation
+
+    def __init__(self, column_name_list, ring_buffer_size=RING_BUFFER_SIZE, initial_slot_num=1024):
+        self.column_name_list = list(column_name_list)
+        self.ring_buffer_size = ring_buffer_size
+        self.slot_index_dict = {}
+        self.timestamp_buffer = np.zeros((initial_slot_num, ring_buffer_size), dtype=np.uint32)
+        self.head_array = np.zeros(initial_slot_num, dtype=np.uint16)  # Position of the next write
+        self.size_array = np.zeros(initial_slot_num, dtype=np.uint16)
+
+    @classmethod
+    def from_history(cls, data_df, column_name_list, ring_buffer_size=RING_BUFFER_SIZE):
+        # Keep the latest clicks of each key in the history, oldest first
+        sorted_indexes, _, is_same_group_array = get_sorted_groups(data_df, column_name_list)
+        is_group_end_array = np.append(~is_same_group_array, True)
+        group_end_index_array = np.flatnonzero(is_group_end_array)
+        group_position_array = np.cumsum(is_group_end_array) - is_group_end_array
+        rank_from_end_array = group_end_index_array[group_position_array] - np.arange(len(sorted_indexes))
+        selected_mask = rank_from_end_array < ring_buffer_size
+
+        state = cls(column_name_list, ring_buffer_size, initial_slot_num=max(len(group_end_index_array), 1))
+        size_array = np.minimum(np.diff(np.append(-1, group_end_index_array)), ring_buffer_size)
+        slot_index_array = group_position_array[selected_mask]
+        buffer_position_array = size_array[slot_index_array] - 1 - rank_from_end_array[selected_mask]
+        state.timestamp_buffer[slot_index_array, buffer_position_array] = data_df[TIMESTAMP_COLUMN_NAME].values[sorted_indexes[selected_mask]]
+        state.size_array[:len(size_array)] = size_array
+        state.head_array[:len(size_array)] = size_array % ring_buffer_size
+        group_key_array_list = [data_df[column_name].values[sorted_indexes[group_end_index_array]] for column_name in column_name_list]
+        state.slot_index_dict = {group_key: slot_index for slot_index, group_key in enumerate(zip(*[group_key_array.tolist() for group_key_array in group_key_array_list]))}
+        return state
+
+    def get_slot_index(self, group_key):
+        slot_index = self.slot_index_dict.get(group_key)
+        if slot_index is None:
+            slot_index = len(self.slot_index_dict)
+            if slot_index == len(self.size_array):
+                # Double the capacity, so that the amortized cost of adding a key stays constant
+                self.timestamp_buffer = np.concatenate([self.timestamp_buffer, np.zeros_like(self.timestamp_buffer)])
+                self.head_array = np.concatenate([self.head_array, np.zeros_like(self.head_array)])
+                self.size_array = np.concatenate([self.size_array, np.zeros_like(self.size_array)])
+            self.slot_index_dict[group_key] = slot_index
+        return slot_index
+
+    def update(self, data_df):
+        # The clicks are expected in time order, and each click is added to the state after its features are computed
+        row_num = len(data_df)
+        prev_click_array = np.full(row_num, np.nan, dtype=DELTA_DTYPE)
+        click_count_array_list = [np.zeros(row_num, dtype=COUNT_DTYPE) for _ in WINDOW_LENGTH_LIST]
+        group_key_list = list(zip(*[data_df[column_name].values.tolist() for column_name in self.column_name_list]))
+        timestamp_list = data_df[TIMESTAMP_COLUMN_NAME].values.tolist()
+        for row_index, (group_key, timestamp) in enumerate(zip(group_key_list, timestamp_list)):
+            slot_index = self.get_slot_index(group_key)
+            timestamp_row = self.timestamp_buffer[slot_index]
+            head, size = int(self.head_array[slot_index]), int(self.size_array[slot_index])
+            if size > 0:
+                prev_click_array[row_index] = timestamp - int(timestamp_row[head - 1])
+            timestamp_row[head] = timestamp
+            head, size = (head + 1) % self.ring_buffer_size, min(size + 1, self.ring_buffer_size)
+            self.head_array[slot_index], self.size_array[slot_index] = head, size
+            for window_index, window_length in enumerate(WINDOW_LENGTH_LIST):
+                click_count_array_list[window_index][row_index] = np.count_nonzero(timestamp_row[:size] > timestamp - window_length)
+        return dict(zip(get_feature_name_list(self.column_name_list, include_next_click=False), [prev_click_array] + click_count_array_list))
+
+    def get_memory_usage(self):
+        # The size of the dictionary is estimated from its entries, i.e., the key tuples and the slot indexes
+        entry_size = 64 + 32 * len(self.column_name_list) + 28
+        return self.timestamp_buffer.nbytes + self.head_array.nbytes + self.size_array.nbytes + entry_size * len(self.slot_index_dict)
+
+def initialize_velocity_states(history_df, velocity_key_list=VELOCITY_KEY_LIST):
+    return [ClickVelocityState.from_history(history_df, column_name_list) for column_name_list in velocity_key_list]
+
+def update_velocity_states(velocity_state_list, data_df):
+    for velocity_state in velocity_state_list:
+        for feature_name, feature_array in velocity_state.update(data_df).items():
+            data_df[feature_name] = feature_array
+    return data_df
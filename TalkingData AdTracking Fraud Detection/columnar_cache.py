@@ -0,0 +1,109 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+# Dataset
+PROJECT_NAME = "TalkingData AdTracking Fraud Detection"
+PROJECT_FOLDER_PATH = os.path.join(os.path.expanduser("~"), "Documents/Dataset", PROJECT_NAME)
+VANILLA_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "vanilla")
+TRAIN_FILE_PATH = os.path.join(VANILLA_FOLDER_PATH, "train.csv")
+TEST_FILE_PATH = os.path.join(VANILLA_FOLDER_PATH, "test.csv")
+
+# Columnar cache, i.e., one raw binary file per typed column
+COLUMNAR_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "columnar")
+COLUMN_NAME_TO_DTYPE_DICT = {"ip": "uint32", "app": "uint16", "device": "uint16", "os": "uint16", "channel": "uint16",
+                             "is_attributed": "bool", "click_id": "uint32", "day": "uint8", "hour": "uint8", "timestamp": "uint32"}
+COLUMN_NAME_LIST = ["ip", "app", "device", "os", "channel", "is_attributed", "click_id", "day", "hour", "timestamp"]
+METADATA_FILE_NAME = "metadata.json"
+CACHE_VERSION = 2
+CHUNK_SIZE = 10 ** 7
+
+def get_cache_folder_path(csv_file_path):
+    return os.path.join(COLUMNAR_FOLDER_PATH, os.path.splitext(os.path.basename(csv_file_path))[0])
+
+def get_file_signature(file_path):
+    file_stat = os.stat(file_path)
+    return [file_stat.st_size, int(file_stat.st_mtime)]
+
+def read_metadata(cache_folder_path):
+    with open(os.path.join(cache_folder_path, METADATA_FILE_NAME)) as metadata_file_object:
+        return json.load(metadata_file_object)
+
+def is_cache_valid(csv_file_path):
+    # The cache is stale if the CSV file has been replaced since the conversion
+    cache_folder_path = get_cache_folder_path(csv_file_path)
+    if not os.path.isfile(os.path.join(cache_folder_path, METADATA_FILE_NAME)):
+        return False
+    metadata = read_metadata(cache_folder_path)
+    if metadata.get("version") != CACHE_VERSION:
+        return False
+    return not os.path.isfile(csv_file_path) or metadata["signature"] == get_file_signature(csv_file_path)
+
+def convert_csv_file(csv_file_path, chunksize=CHUNK_SIZE):
+    cache_folder_path = get_cache_folder_path(csv_file_path)
+    temporary_folder_path = cache_folder_path + ".tmp"
+    shutil.rmtree(temporary_folder_path, ignore_errors=True)
+    os.makedirs(temporary_folder_path)
+
+    column_name_to_file_object_dict = {}
+    row_num = 0
+    try:
+        usecols = lambda column_name: column_name != "attributed_time"
+        for chunk_df in pd.read_csv(csv_file_path, usecols=usecols, dtype=COLUMN_NAME_TO_DTYPE_DICT, chunksize=chunksize):
+            # Slicing the fixed-width timestamps is much cheaper than parsing them, and the explicit format keeps the parsing on the fast path
+            chunk_df["day"] = chunk_df["click_time"].str.slice(8, 10).astype("uint8")
+            chunk_df["hour"] = chunk_df["click_time"].str.slice(11, 13).astype("uint8")
+            chunk_df["timestamp"] = pd.to_datetime(chunk_df["click_time"], format="%Y-%m-%d %H:%M:%S").values.astype("datetime64[s]").astype("int64").astype("uint32")
+            for column_name in COLUMN_NAME_LIST:
+                if column_name not in chunk_df.columns:
+                    continue
+                if column_name not in column_name_to_file_object_dict:
+                    column_name_to_file_object_dict[column_name] = open(os.path.join(temporary_folder_path, "{}.bin".format(column_name)), "wb")
+                chunk_df[column_name].values.astype(COLUMN_NAME_TO_DTYPE_DICT[column_name], copy=False).tofile(column_name_to_file_object_dict[column_name])
+            row_num += len(chunk_df)
+            print("Converted {} rows of {} ...".format(row_num, os.path.basename(csv_file_path)))
+    finally:
+        for file_object in column_name_to_file_object_dict.values():
+            file_object.close()
+
+    # The metadata is written last, and the folder is renamed, so that an interrupted conversion is never picked up
+    metadata = {"version": CACHE_VERSION, "signature": get_file_signature(csv_file_path), "row_num": row_num,
+                "column_name_list": [column_name for column_name in COLUMN_NAME_LIST if column_name in column_name_to_file_object_dict]}
+    with open(os.path.join(temporary_folder_path, METADATA_FILE_NAME), "w") as metadata_file_object:
+        json.dump(metadata, metadata_file_object)
+    shutil.rmtree(cache_folder_path, ignore_errors=True)
+    os.replace(temporary_folder_path, cache_folder_path)
+
+def load_columns(csv_file_path, nrows=None):
+    # The columns are memory-mapped, so nothing is read until it is accessed
+    cache_folder_path = get_cache_folder_path(csv_file_path)
+    metadata = read_metadata(cache_folder_path)
+    row_num = metadata["row_num"] if nrows is None else min(nrows, metadata["row_num"])
+    column_name_to_array_dict = {}
+    for column_name in metadata["column_name_list"]:
+        column_array = np.memmap(os.path.join(cache_folder_path, "{}.bin".format(column_name)), dtype=COLUMN_NAME_TO_DTYPE_DICT[column_name], mode="r") if row_num > 0 \
+            else np.zeros(0, dtype=COLUMN_NAME_TO_DTYPE_DICT[column_name])
+        column_name_to_array_dict[column_name] = column_array[:row_num]
+    return column_name_to_array_dict
+
+def load_data_frame(csv_file_path, nrows=None, row_slice=slice(None)):
+    column_name_to_array_dict = load_columns(csv_file_path, nrows)
+    return pd.DataFrame({column_name: np.array(column_array[row_slice]) for column_name, column_array in column_name_to_array_dict.items()},
+                        columns=list(column_name_to_array_dict.keys()))
+
+def iterate_chunks(csv_file_path, nrows=None, chunksize=CHUNK_SIZE):
+    row_num = len(next(iter(load_columns(csv_file_path, nrows).values())))
+    for start_index in range(0, row_num, chunksize):
+        yield load_data_frame(csv_file_path, nrows, slice(start_index, start_index + chunksize))
+
+def run():
+    for csv_file_path in [TRAIN_FILE_PATH, TEST_FILE_PATH]:
+        print("Converting {} to {} ...".format(csv_file_path, get_cache_folder_path(csv_file_path)))
+        convert_csv_file(csv_file_path)
+
+    print("All done!")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+import stage_timeline
+
+# Each group feature is defined by its name, the columns to group by, the column to aggregate and the statistic
+GROUP_FEATURE_LIST = [("ip_tcount", ["ip", "day", "hour"], "channel", "count"),
+                      ("ip_app_count", ["ip", "app"], "channel", "count"),
+                      ("ip_app_os_count", ["ip", "app", "os"], "channel", "count"),
+                      ("ip_tchan_count", ["ip", "day", "channel"], "hour", "var"),
+                      ("ip_app_os_var", ["ip", "app", "os"], "hour", "var"),
+                      ("ip_app_channel_var_day", ["ip", "app", "channel"], "day", "var"),
+                      ("ip_app_channel_mean_hour", ["ip", "app", "channel"], "hour", "mean")]
+COUNT_DTYPE = np.uint32
+STATISTIC_DTYPE = np.float32
+
+def encode_group_key(data_df, column_name_list):
+    # Pack the columns into a single integer with a mixed radix, and factorize the packed key into dense group indexes
+    packed_key_array = np.zeros(len(data_df), dtype=np.int64)
+    packed_key_radix = 1
+    for column_name in column_name_list:
+        column_array = data_df[column_name].values
+        column_radix = int(column_array.max()) + 1 if len(column_array) > 0 else 1
+        if packed_key_radix * column_radix > np.iinfo(np.int64).max:
+            # Compact the key which has been packed so far, so that the next column still fits
+            packed_key_array, unique_key_array = pd.factorize(packed_key_array)
+            packed_key_radix = len(unique_key_array)
+        packed_key_array *= column_radix
+        packed_key_array += column_array
+        packed_key_radix *= column_radix
+    group_index_array, unique_key_array = pd.factorize(packed_key_array)
+    return group_index_array, len(unique_key_array)
+
+def compute_group_statistic(group_index_array, group_num, group_count_array, value_array, statistic):
+    if statistic == "count":
+        return group_count_array.astype(COUNT_DTYPE)[group_index_array]
+
+    # Same conventions as pandas, i.e., the variance uses ddof=1 and is NaN for groups with a single entry
+    value_array = value_array.astype(np.float64)
+    group_mean_array = np.bincount(group_index_array, weights=value_array, minlength=group_num) / group_count_array
+    if statistic == "mean":
+        return group_mean_array.astype(STATISTIC_DTYPE)[group_index_array]
+    if statistic == "var":
+        deviation_array = value_array - group_mean_array[group_index_array]
+        deviation_array *= deviation_array
+        with np.errstate(divide="ignore", invalid="ignore"):
+            group_var_array = np.bincount(group_index_array, weights=deviation_array, minlength=group_num) / (group_count_array - 1)
+        return group_var_array.astype(STATISTIC_DTYPE)[group_index_array]
+    assert False, "Unknown statistic {}!".format(statistic)
+
+def add_group_features(data_df, group_feature_list=GROUP_FEATURE_LIST, timeline=None):
+    # Each group key is only encoded once, and it is released after its last use
+    timeline = stage_timeline.StageTimeline(enabled=False) if timeline is None else timeline
+    group_key_list = [tuple(group_column_name_list) for _, group_column_name_list, _, _ in group_feature_list]
+    last_use_index_dict = {group_key: feature_index for feature_index, group_key in enumerate(group_key_list)}
+    group_cache_dict = {}
+    for feature_index, (feature_name, _, value_column_name, statistic) in enumerate(group_feature_list):
+        group_key = group_key_list[feature_index]
+        with timeline.stage("Grouping by {} to compute {}".format("-".join(group_key), feature_name), lambda: [data_df]):
+            print("Grouping by {} to compute {} ...".format("-".join(group_key), feature_name))
+            if group_key not in group_cache_dict:
+                group_index_array, group_num = encode_group_key(data_df, group_key)
+                group_count_array = np.bincount(group_index_array, minlength=group_num)
+                group_cache_dict[group_key] = (group_index_array, group_num, group_count_array)
+
+            # The feature is written into its own column directly, so that the data frame is never copied
+            data_df[feature_name] = compute_group_statistic(*group_cache_dict[group_key], value_array=data_df[value_column_name].values, statistic=statistic)
+            if last_use_index_dict[group_key] == feature_index:
+                del group_cache_dict[group_key]
+    return data_df
+
+def get_packed_key(data_df, column_name_list):
+    # Shift each column by the bit width of its dtype, so that the keys of different chunks are comparable
+    packed_key_array = np.zeros(len(data_df), dtype=np.uint64)
+    bit_num = 0
+    for column_name in column_name_list:
+        column_array = data_df[column_name].values
+        column_bit_num = column_array.dtype.itemsize * 8
+        packed_key_array <<= np.uint64(column_bit_num)
+        packed_key_array |= column_array.astype(np.uint64)
+        bit_num += column_bit_num
+    assert bit_num <= 64, "Columns {} do not fit in a packed key!".format(column_name_list)
+    return packed_key_array
+
+def initialize_group_tables(group_feature_list=GROUP_FEATURE_LIST):
+    # Each group table holds the sorted packed keys, the counts, the means and the sums of squared deviations which are required by the statistics
+    group_table_dict = {}
+    for _, group_column_name_list, value_column_name, statistic in group_feature_list:
+        group_table = group_table_dict.setdefault(tuple(group_column_name_list), {"key": np.zeros(0, dtype=np.uint64), "count": np.zeros(0)})
+        if statistic in ["mean", "var"]:
+            group_table.setdefault(("mean", value_column_name), np.zeros(0))
+        if statistic == "var":
+            group_table.setdefault(("m2", value_column_name), np.zeros(0))
+    return group_table_dict
+
+def merge_group_moments(group_table, group_index_array, chunk_group_index_array, chunk_df):
+    # Merge the moments of the chunk groups into the tables with the pairwise update of Chan et al., which stays accurate
+    # where the one-pass formula based on the sum of squares suffers from catastrophic cancellation.
+    # Each entry of group_index_array must be unique, since the tables are updated with fancy indexing.
+    chunk_group_num = len(group_index_array)
+    count_array = group_table["count"][group_index_array]
+    chunk_count_array = np.bincount(chunk_group_index_array, minlength=chunk_group_num).astype(np.float64)
+    merged_count_array = count_array + chunk_count_array
+    for table_name in list(group_table.keys()):
+        if not isinstance(table_name, tuple) or table_name[0] != "mean":
+            continue
+        value_array = chunk_df[table_name[1]].values.astype(np.float64)
+        chunk_mean_array = np.bincount(chunk_group_index_array, weights=value_array, minlength=chunk_group_num) / chunk_count_array
+        delta_array = chunk_mean_array - group_table[table_name][group_index_array]
+        group_table[table_name][group_index_array] += delta_array * chunk_count_array / merged_count_array
+        m2_table_name = ("m2", table_name[1])
+        if m2_table_name in group_table:
+            deviation_array = value_array - chunk_mean_array[chunk_group_index_array]
+            deviation_array *= deviation_array
+            chunk_m2_array = np.bincount(chunk_group_index_array, weights=deviation_array, minlength=chunk_group_num)
+            group_table[m2_table_name][group_index_array] += chunk_m2_array + delta_array * delta_array * count_array * chunk_count_array / merged_count_array
+    group_table["count"][group_index_array] = merged_count_array
+
+def update_group_tables(group_table_dict, chunk_df):
+    for group_key, group_table in group_table_dict.items():
+        # Aggregate the chunk on its own keys, so that the tables are only touched by a merge of two sorted arrays
+        chunk_key_array, chunk_group_index_array = np.unique(get_packed_key(chunk_df, group_key), return_inverse=True)
+        insert_index_array = np.searchsorted(group_table["key"], chunk_key_array)
+        is_new_array = insert_index_array == len(group_table["key"])
+        is_new_array[~is_new_array] = group_table["key"][insert_index_array[~is_new_array]] != chunk_key_array[~is_new_array]
+        # Each existing key is shifted by the number of new keys inserted before it
+        group_index_array = insert_index_array + np.cumsum(is_new_array) - is_new_array
+        for table_name in list(group_table.keys()):
+            inserted_value = chunk_key_array[is_new_array] if table_name == "key" else 0
+            group_table[table_name] = np.insert(group_table[table_name], insert_index_array[is_new_array], inserted_value)
+        merge_group_moments(group_table, group_index_array, chunk_group_index_array, chunk_df)
+
+def compute_statistic_from_moments(group_table, group_index_array, value_column_name, statistic):
+    group_count_array = group_table["count"][group_index_array]
+    if statistic == "count":
+        return group_count_array.astype(COUNT_DTYPE)
+    if statistic == "mean":
+        return group_table[("mean", value_column_name)][group_index_array].astype(STATISTIC_DTYPE)
+    if statistic == "var":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            group_var_array = group_table[("m2", value_column_name)][group_index_array] / (group_count_array - 1)
+        return np.maximum(group_var_array, 0).astype(STATISTIC_DTYPE)
+    assert False, "Unknown statistic {}!".format(statistic)
+
+def finalize_group_tables(group_table_dict, group_feature_list=GROUP_FEATURE_LIST):
+    # Compute the statistics of each group once, so that looking up a chunk only gathers values
+    group_feature_dict = {}
+    for feature_name, group_column_name_list, value_column_name, statistic in group_feature_list:
+        group_table = group_table_dict[tuple(group_column_name_list)]
+        group_feature_array = compute_statistic_from_moments(group_table, slice(None), value_column_name, statistic)
+        group_feature_dict[feature_name] = (tuple(group_column_name_list), group_feature_array)
+    return group_feature_dict
+
+def lookup_group_features(group_table_dict, group_feature_dict, chunk_df):
+    group_index_cache_dict = {}
+    for feature_name, (group_key, group_feature_array) in group_feature_dict.items():
+        if group_key not in group_index_cache_dict:
+            group_index_cache_dict[group_key] = np.searchsorted(group_table_dict[group_key]["key"], get_packed_key(chunk_df, group_key))
+        chunk_df[feature_name] = group_feature_array[group_index_cache_dict[group_key]]
+    return chunk_df
+
+class OnlineGroupTables(object):
+    # Keeps the group tables of the history in memory, so that the clicks of a live stream are added in place,
+    # and the keys which are not in the history get new slots from a hash table
+
+    def __init__(self, group_table_dict, group_feature_list=GROUP_FEATURE_LIST, initial_capacity=1024):
+        self.group_feature_list = group_feature_list
+        self.group_key_array_dict = {}
+        self.group_table_dict = {}
+        self.new_slot_index_dict = {}
+        for group_key, group_table in group_table_dict.items():
+            self.group_key_array_dict[group_key] = group_table["key"]
+            self.group_table_dict[group_key] = {table_name: np.concatenate([table_array, np.zeros(initial_capacity)])
+                                                for table_name, table_array in group_table.items() if table_name != "key"}
+            self.new_slot_index_dict[group_key] = {}
+
+    def get_slot_indexes(self, group_key, packed_key_array):
+        group_key_array = self.group_key_array_dict[group_key]
+        slot_index_array = np.searchsorted(group_key_array, packed_key_array)
+        is_new_array = slot_index_array == len(group_key_array)
+        is_new_array[~is_new_array] = group_key_array[slot_index_array[~is_new_array]] != packed_key_array[~is_new_array]
+        if np.any(is_new_array):
+            new_slot_index_dict = self.new_slot_index_dict[group_key]
+            group_table = self.group_table_dict[group_key]
+            for row_index in np.flatnonzero(is_new_array):
+                packed_key = int(packed_key_array[row_index])
+                if packed_key not in new_slot_index_dict:
+                    new_slot_index = len(group_key_array) + len(new_slot_index_dict)
+                    if new_slot_index == len(group_table["count"]):
+                        # Double the capacity, so that the amortized cost of adding a key stays constant
+                        for table_name, table_array in group_table.items():
+                            group_table[table_name] = np.concatenate([table_array, np.zeros_like(table_array)])
+                    new_slot_index_dict[packed_key] = new_slot_index
+                slot_index_array[row_index] = new_slot_index_dict[packed_key]
+        return slot_index_array
+
+    def update(self, data_df):
+        # Add the clicks to the tables, and then compute the features of the clicks from the updated tables
+        slot_index_array_dict = {}
+        for group_key, group_table in self.group_table_dict.items():
+            slot_index_array = self.get_slot_indexes(group_key, get_packed_key(data_df, group_key))
+            # The clicks are aggregated per slot first, so that the same slot is never updated twice by fancy indexing
+            unique_slot_index_array, batch_group_index_array = np.unique(slot_index_array, return_inverse=True)
+            merge_group_moments(group_table, unique_slot_index_array, batch_group_index_array, data_df)
+            slot_index_array_dict[group_key] = slot_index_array
+
+        for feature_name, group_column_name_list, value_column_name, statistic in self.group_feature_list:
+            group_key = tuple(group_column_name_list)
+            data_df[feature_name] = compute_statistic_from_moments(self.group_table_dict[group_key], slot_index_array_dict[group_key], value_column_name, statistic)
+        return data_df
+
+    def get_memory_usage(self):
+        # The size of the hash tables is estimated from their entries
+        memory_usage = 0
+        for group_key, group_table in self.group_table_dict.items():
+            memory_usage += self.group_key_array_dict[group_key].nbytes + sum(table_array.nbytes for table_array in group_table.values())
+            memory_usage += 100 * len(self.new_slot_index_dict[group_key])
+        return memory_usage
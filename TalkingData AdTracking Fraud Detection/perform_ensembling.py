@@ -1,9 +1,9 @@
 import os
 import glob
-import shutil
 import datetime
 import numpy as np
 import pandas as pd
+import submission_writer
 
 # Dataset
 PROJECT_NAME = "TalkingData AdTracking Fraud Detection"
@@ -18,34 +18,45 @@ os.makedirs(SUBMISSION_FOLDER_PATH, exist_ok=True)
 WORKSPACE_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "script/Mar_25_3")
 KEYWORD = "DL"
 
-# Generate a zip archive for a file
-create_zip_archive = lambda file_path: shutil.make_archive(file_path[:file_path.rindex(".")], "zip", os.path.abspath(os.path.join(file_path, "..")), os.path.basename(file_path))
+def read_columns(file_path, column_name_list):
+    # Plain CSV files are memory-mapped and zip archives are decompressed on the fly,
+    # and only the requested columns are converted by the C parser of pandas in a single pass
+    submission_df = pd.read_csv(file_path, usecols=column_name_list, dtype={column_name: np.float64 for column_name in column_name_list},
+                                engine="c", memory_map=not file_path.endswith(".zip"))
+    return [submission_df[column_name].values for column_name in column_name_list]
 
 def run():
     print("Searching for submissions with keyword {} at {} ...".format(KEYWORD, WORKSPACE_FOLDER_PATH))
     submission_file_path_list = sorted(glob.glob(os.path.join(WORKSPACE_FOLDER_PATH, "*{}*".format(KEYWORD))))
     assert len(submission_file_path_list) != 0
 
-    ranking_array_list = []
+    # Only the sum of the rankings is kept, so the memory usage does not grow with the number of submissions
+    click_id_array = None
+    ranking_sum_array = None
     for submission_file_path in submission_file_path_list:
         print("Loading {} ...".format(submission_file_path))
-        submission_df = pd.read_csv(submission_file_path)
+        if click_id_array is None:
+            prediction_array, click_id_array = read_columns(submission_file_path, ["is_attributed", "click_id"])
+            click_id_array = click_id_array.astype(np.uint32)
+            ranking_sum_array = np.zeros(len(prediction_array), dtype=np.float64)
+        else:
+            prediction_array, = read_columns(submission_file_path, ["is_attributed"])
+        assert len(prediction_array) == len(ranking_sum_array)
 
         print("Ranking the entries ...")
-        index_series = submission_df["is_attributed"].argsort()
-        ranking_array = np.zeros(index_series.shape, dtype=np.uint32)
-        ranking_array[index_series] = np.arange(len(index_series))
-        ranking_array_list.append(ranking_array)
+        index_array = np.argsort(prediction_array, kind="mergesort")
+        prediction_array = None
+        ranking_sum_array[index_array] += np.arange(len(index_array))
+        index_array = None
 
-    ensemble_df = submission_df.copy()
-    ensemble_prediction_array = np.mean(ranking_array_list, axis=0)
+    ensemble_df = pd.DataFrame({"click_id": click_id_array}, columns=["click_id"])
+    ensemble_prediction_array = ranking_sum_array / len(submission_file_path_list)
     apply_normalization = lambda data_array: 1.0 * (data_array - np.min(data_array)) / (np.max(data_array) - np.min(data_array))
     ensemble_df["is_attributed"] = apply_normalization(ensemble_prediction_array)
     ensemble_file_path = os.path.join(SUBMISSION_FOLDER_PATH, "{} {} {}.csv".format(TEAM_NAME, KEYWORD, str(datetime.datetime.now()).split(".")[0]).replace(" ", "_"))
-    print("Saving submission to {} ...".format(ensemble_file_path))
-    ensemble_df.to_csv(ensemble_file_path, float_format="%.6f", index=False)
-    compressed_ensemble_file_path = create_zip_archive(ensemble_file_path)
-    print("Saving compressed submission to {} ...".format(compressed_ensemble_file_path))
+    print("Saving compressed submission to {} ...".format(ensemble_file_path))
+    compressed_ensemble_file_path = submission_writer.write_submission(ensemble_df, ensemble_file_path, compression="zip")
+    print("Saved compressed submission to {}.".format(compressed_ensemble_file_path))
 
     print("All done!")
 
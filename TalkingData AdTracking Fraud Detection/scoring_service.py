@@ -0,0 +1,108 @@
+import time
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+import group_features
+import click_velocity
+import categorical_encoding
+import solution
+
+# Scoring procedure
+BATCH_SIZE = 100
+STREAM_BATCH_NUM = 10000
+VELOCITY_HISTORY_LENGTH = 24 * 3600  # Only the clicks within the last day of the history seed the ring buffers
+LATENCY_BIN_EDGE_LIST = [0, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, np.inf]  # In milliseconds
+
+class ScoringService(object):
+    # Scores micro-batches of clicks with the saved booster, and keeps the aggregate state of load_data up to date
+
+    def __init__(self, model_file_path=solution.MODEL_FILE_PATH):
+        print("Loading model from {} ...".format(model_file_path))
+        self.model = lgb.Booster(model_file=model_file_path)
+        self.feature_name_list = self.model.feature_name()
+        self.velocity_key_list = [column_name_list for column_name_list in click_velocity.VELOCITY_KEY_LIST
+                                  if not set(click_velocity.get_feature_name_list(column_name_list)).isdisjoint(self.feature_name_list)]
+
+        # The features which require lookahead cannot be computed online, and they are left as missing values
+        online_feature_name_list = ["ip", "app", "device", "os", "channel", "day", "hour"] + [feature_name for feature_name, _, _, _ in group_features.GROUP_FEATURE_LIST]
+        for column_name_list in self.velocity_key_list:
+            online_feature_name_list += click_velocity.get_feature_name_list(column_name_list, include_next_click=False)
+        missing_feature_name_list = [feature_name for feature_name in self.feature_name_list if feature_name not in online_feature_name_list]
+        if len(missing_feature_name_list) > 0:
+            print("Features {} are not available online, and they are treated as missing values!".format(missing_feature_name_list))
+
+        self.encoder_dict = {}
+        if solution.ENCODE_CATEGORICAL_FEATURES:
+            print("Loading categorical encoders from {} ...".format(solution.ENCODER_FILE_PATH))
+            self.encoder_dict = categorical_encoding.load_encoders(solution.ENCODER_FILE_PATH)
+
+        self.online_group_tables = None
+        self.velocity_state_list = []
+        self.batch_size_list = []
+        self.latency_list = []
+
+    def load_history(self, file_path_list, nrows=None):
+        group_table_dict = group_features.initialize_group_tables()
+        recent_chunk_df_list = []
+        velocity_column_name_list = list(dict.fromkeys(sum(self.velocity_key_list, []) + [click_velocity.TIMESTAMP_COLUMN_NAME]))
+        for file_path in file_path_list:
+            for chunk_df in solution.read_chunks(file_path, nrows):
+                print("Adding {} clicks of {} to the state ...".format(len(chunk_df), file_path))
+                group_features.update_group_tables(group_table_dict, chunk_df)
+                if len(self.velocity_key_list) > 0:
+                    # The click logs are sorted by time, so the chunks which are too old can be dropped early
+                    recent_chunk_df_list.append(chunk_df[velocity_column_name_list])
+                    latest_timestamp = int(chunk_df[click_velocity.TIMESTAMP_COLUMN_NAME].max())
+                    while int(recent_chunk_df_list[0][click_velocity.TIMESTAMP_COLUMN_NAME].max()) <= latest_timestamp - VELOCITY_HISTORY_LENGTH:
+                        recent_chunk_df_list.pop(0)
+        self.online_group_tables = group_features.OnlineGroupTables(group_table_dict)
+
+        if len(self.velocity_key_list) > 0:
+            history_df = pd.concat(recent_chunk_df_list, ignore_index=True)
+            history_df = history_df[history_df[click_velocity.TIMESTAMP_COLUMN_NAME] > history_df[click_velocity.TIMESTAMP_COLUMN_NAME].max() - VELOCITY_HISTORY_LENGTH]
+            self.velocity_state_list = click_velocity.initialize_velocity_states(history_df, self.velocity_key_list)
+        print("The state takes {:.1f} MB.".format(self.get_state_memory_usage() / 1024 ** 2))
+
+    def score_batch(self, batch_df):
+        start_time = time.perf_counter()
+        batch_df = batch_df.copy()
+        self.online_group_tables.update(batch_df)
+        click_velocity.update_velocity_states(self.velocity_state_list, batch_df)
+        # The aggregate state uses the raw values, so the categorical features are only encoded for the model
+        feature_df = categorical_encoding.transform(batch_df.reindex(columns=self.feature_name_list), self.encoder_dict)
+        prediction_array = self.model.predict(feature_df)
+        self.latency_list.append(time.perf_counter() - start_time)
+        self.batch_size_list.append(len(batch_df))
+        return prediction_array
+
+    def get_state_memory_usage(self):
+        memory_usage = 0 if self.online_group_tables is None else self.online_group_tables.get_memory_usage()
+        return memory_usage + sum(velocity_state.get_memory_usage() for velocity_state in self.velocity_state_list)
+
+    def report(self):
+        latency_array = np.array(self.latency_list) * 1000
+        print("Scored {} clicks in {} batches with mean batch size {:.1f}.".format(np.sum(self.batch_size_list), len(self.batch_size_list), np.mean(self.batch_size_list)))
+        print("Latency in ms: p50={:.3f}, p90={:.3f}, p99={:.3f}, max={:.3f}.".format(*np.percentile(latency_array, [50, 90, 99, 100])))
+        print("Latency histogram:")
+        count_array, _ = np.histogram(latency_array, bins=LATENCY_BIN_EDGE_LIST)
+        for low_edge, high_edge, count in zip(LATENCY_BIN_EDGE_LIST[:-1], LATENCY_BIN_EDGE_LIST[1:], count_array):
+            print("[{}, {}) ms: {}".format(low_edge, high_edge, count))
+        print("The state takes {:.1f} MB.".format(self.get_state_memory_usage() / 1024 ** 2))
+
+def run():
+    scoring_service = ScoringService()
+
+    print("Loading the history of clicks ...")
+    scoring_service.load_history([solution.TRAIN_FILE_PATH], nrows=solution.SAMPLE_NUM)
+
+    print("Replaying the testing clicks in batches of {} ...".format(BATCH_SIZE))
+    for batch_index, batch_df in enumerate(solution.read_chunks(solution.TEST_FILE_PATH, nrows=BATCH_SIZE * STREAM_BATCH_NUM, chunksize=BATCH_SIZE)):
+        scoring_service.score_batch(batch_df)
+        if (batch_index + 1) % 1000 == 0:
+            print("Scored {} batches ...".format(batch_index + 1))
+    scoring_service.report()
+
+    print("All done!")
+
+if __name__ == "__main__":
+    run()
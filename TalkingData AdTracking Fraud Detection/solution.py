@@ -1,11 +1,19 @@
 import os
 import gc
+import json
 import shutil
+import hashlib
 import datetime
 import numpy as np
 import pandas as pd
 import lightgbm as lgb
 from sklearn.model_selection import train_test_split
+import group_features
+import columnar_cache
+import click_velocity
+import submission_writer
+import categorical_encoding
+import stage_timeline
 
 # Dataset
 PROJECT_NAME = "TalkingData AdTracking Fraud Detection"
@@ -15,6 +23,23 @@ TRAIN_FILE_PATH = os.path.join(VANILLA_FOLDER_PATH, "train.csv")
 TEST_FILE_PATH = os.path.join(VANILLA_FOLDER_PATH, "test.csv")
 SAMPLE_NUM = None
 
+# Read the typed columns converted by columnar_cache.py instead of parsing the CSV files, if they are available
+USE_COLUMNAR_CACHE = True
+
+# Add the click velocity features, i.e., previous-click and next-click deltas and rolling counts of each key
+ADD_VELOCITY_FEATURES = False
+
+# Record the wall time and the memory usage of each stage of load_data
+PROFILE_STAGES = True
+RENDER_TIMELINE_CHART = True
+TIMELINE_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "timeline")
+
+# Out-of-core mode, i.e., the CSV files are processed in chunks and the features are stored in a memory-mapped matrix which LightGBM reads directly
+CHUNK_MODE = False
+CHUNK_SIZE = 10 ** 7
+FEATURE_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "feature")
+FEATURE_MATRIX_DTYPE = np.float32
+
 # Submission
 TEAM_NAME = "Aurora"
 SUBMISSION_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "submission")
@@ -24,120 +49,267 @@ os.makedirs(SUBMISSION_FOLDER_PATH, exist_ok=True)
 NUM_BOOST_ROUND = 1000000
 EARLY_STOPPING_ROUNDS = 50
 VERBOSE_EVAL = 10
+MODEL_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "model")
+MODEL_FILE_PATH = os.path.join(MODEL_FOLDER_PATH, "LightGBM.txt")
+
+# Remap the categorical features to dense codes ordered by frequency, and save the mapping for testing and online traffic
+ENCODE_CATEGORICAL_FEATURES = True
+ENCODER_FILE_PATH = os.path.join(MODEL_FOLDER_PATH, "categorical_encoders.npz")
 
-# Generate a zip archive for a file
-create_zip_archive = lambda file_path: shutil.make_archive(file_path[:file_path.rindex(".")], "zip", os.path.abspath(os.path.join(file_path, "..")), os.path.basename(file_path))
+# Save the constructed LightGBM datasets in binary format, so that later runs with the same features skip the binning
+USE_DATASET_CACHE = True
+DATASET_CACHE_FOLDER_PATH = os.path.join(PROJECT_FOLDER_PATH, "dataset_cache")
 
 def release_resources():
     unreachable_objects_num = gc.collect()
     print("Collected {} unreachable objects ...".format(unreachable_objects_num))
 
-def load_data(nrows=SAMPLE_NUM):
+def read_data(file_path, nrows=SAMPLE_NUM):
+    if USE_COLUMNAR_CACHE and columnar_cache.is_cache_valid(file_path):
+        print("Loading {} from the columnar cache ...".format(os.path.basename(file_path)))
+        return columnar_cache.load_data_frame(file_path, nrows)
+
     parse_dates = ["click_time"]
     dtype = {"ip": "uint32", "app": "uint16", "device": "uint16", "os": "uint16", "channel": "uint16", "is_attributed": "bool", "click_id": "uint32"}
+    print("Loading {} ...".format(os.path.basename(file_path)))
+    data_df = pd.read_csv(file_path, parse_dates=parse_dates, dtype=dtype, nrows=nrows)
+    data_df.drop("attributed_time", axis=1, inplace=True, errors="ignore")
 
-    print("Loading training data ...")
-    train_df = pd.read_csv(TRAIN_FILE_PATH, parse_dates=parse_dates, dtype=dtype, nrows=nrows)
-    train_df.drop("attributed_time", axis=1, inplace=True)
-    train_num = len(train_df)
+    print("Extracting date time info ...")
+    data_df["day"] = data_df["click_time"].dt.day.astype("uint8")
+    data_df["hour"] = data_df["click_time"].dt.hour.astype("uint8")
+    data_df["timestamp"] = data_df["click_time"].values.astype("datetime64[s]").astype("int64").astype("uint32")
+    data_df.drop("click_time", axis=1, inplace=True)
+    return data_df
 
-    print("Loading testing data ...")
-    test_df = pd.read_csv(TEST_FILE_PATH, parse_dates=parse_dates, dtype=dtype, nrows=nrows)
-    submission_df = pd.DataFrame(test_df["click_id"])
-    test_df.drop("click_id", axis=1, inplace=True)
+def load_data(nrows=SAMPLE_NUM):
+    # The data frames are declared upfront, so that the timeline can measure them before they are created
+    timeline = stage_timeline.StageTimeline(enabled=PROFILE_STAGES)
+    train_df, valid_df, test_df, merged_df = None, None, None, None
+    with timeline.stage("Loading training data", lambda: [train_df]):
+        print("Loading training data ...")
+        train_df = read_data(TRAIN_FILE_PATH, nrows)
+        train_num = len(train_df)
 
-    print("Merging training data and testing data ...")
-    merged_df = pd.concat([train_df, test_df], copy=False)
-    train_df, test_df = None, None
-    release_resources()
+    with timeline.stage("Loading testing data", lambda: [train_df, test_df]):
+        print("Loading testing data ...")
+        test_df = read_data(TEST_FILE_PATH, nrows)
+        submission_df = pd.DataFrame(test_df["click_id"])
+        test_df.drop("click_id", axis=1, inplace=True)
 
-    print("Extracting date time info ...")
-    merged_df["day"] = merged_df["click_time"].dt.day.astype("uint8")
-    merged_df["hour"] = merged_df["click_time"].dt.hour.astype("uint8")
-    merged_df.drop("click_time", axis=1, inplace=True)
-
-    print("Grouping by ip-day-hour ...")
-    temp_df = merged_df[["ip", "day", "hour", "channel"]].groupby(by=["ip", "day", "hour"])[["channel"]].count().reset_index().rename(index=str, columns={"channel": "ip_tcount"})
-    merged_df = merged_df.merge(temp_df, on=["ip", "day", "hour"], how="left")
-    temp_df = None
-    release_resources()
+    with timeline.stage("Merging training data and testing data", lambda: [train_df, test_df, merged_df]):
+        print("Merging training data and testing data ...")
+        merged_df = pd.concat([train_df, test_df], ignore_index=True, copy=False)
+        train_df, test_df = None, None
+        release_resources()
 
-    print("Grouping by ip-app ...")
-    temp_df = merged_df[["ip", "app", "channel"]].groupby(by=["ip", "app"])[["channel"]].count().reset_index().rename(index=str, columns={"channel": "ip_app_count"})
-    merged_df = merged_df.merge(temp_df, on=["ip", "app"], how="left")
-    temp_df = None
+    print("Adding group features ...")
+    group_features.add_group_features(merged_df, timeline=timeline)
     release_resources()
 
-    print("Grouping by ip-app-os ...")
-    temp_df = merged_df[["ip", "app", "os", "channel"]].groupby(by=["ip", "app", "os"])[["channel"]].count().reset_index().rename(index=str, columns={"channel": "ip_app_os_count"})
-    merged_df = merged_df.merge(temp_df, on=["ip", "app", "os"], how="left")
-    temp_df = None
-    release_resources()
+    if ADD_VELOCITY_FEATURES:
+        with timeline.stage("Adding click velocity features", lambda: [merged_df]):
+            print("Adding click velocity features ...")
+            click_velocity.add_click_velocity_features(merged_df)
+            release_resources()
+    merged_df.drop(click_velocity.TIMESTAMP_COLUMN_NAME, axis=1, inplace=True)
 
-    print("Grouping by ip_day_chl_var_hour ...")
-    temp_df = merged_df[["ip", "day", "hour", "channel"]].groupby(by=["ip", "day", "channel"])[["hour"]].var().reset_index().rename(index=str, columns={"hour": "ip_tchan_count"})
-    merged_df = merged_df.merge(temp_df, on=["ip", "day", "channel"], how="left")
-    temp_df = None
-    release_resources()
+    with timeline.stage("Splitting data", lambda: [merged_df, train_df, valid_df, test_df]):
+        print("Splitting data ...")
+        train_indexes, valid_indexes = train_test_split(np.arange(train_num), test_size=0.1, random_state=0)
+        train_df, valid_df = merged_df.iloc[train_indexes], merged_df.iloc[valid_indexes]
+        test_df = merged_df.iloc[train_num:].drop("is_attributed", axis=1)
+        merged_df = None
+        release_resources()
 
-    print("Grouping by ip_app_os_var_hour ...")
-    temp_df = merged_df[["ip", "app", "os", "hour"]].groupby(by=["ip", "app", "os"])[["hour"]].var().reset_index().rename(index=str, columns={"hour": "ip_app_os_var"})
-    merged_df = merged_df.merge(temp_df, on=["ip", "app", "os"], how="left")
-    temp_df = None
-    release_resources()
+    print("Getting summary of train_df, valid_df and test_df ...")
+    for current_df in [train_df, valid_df, test_df]:
+        current_df.info(verbose=False, memory_usage=True)
 
-    print("Grouping by ip_app_channel_var_day ...")
-    temp_df = merged_df[["ip", "app", "channel", "day"]].groupby(by=["ip", "app", "channel"])[["day"]].var().reset_index().rename(index=str, columns={"day": "ip_app_channel_var_day"})
-    merged_df = merged_df.merge(temp_df, on=["ip", "app", "channel"], how="left")
-    temp_df = None
-    release_resources()
+    if PROFILE_STAGES:
+        os.makedirs(TIMELINE_FOLDER_PATH, exist_ok=True)
+        timeline_file_path = os.path.join(TIMELINE_FOLDER_PATH, "load_data {}".format(str(datetime.datetime.now()).split(".")[0]).replace(" ", "_"))
+        print("Saving stage timeline to {}.json ...".format(timeline_file_path))
+        timeline.export_json(timeline_file_path + ".json")
+        if RENDER_TIMELINE_CHART:
+            timeline.render_chart(timeline_file_path + ".png")
 
-    print("Grouping by ip_app_chl_mean_hour ...")
-    temp_df = merged_df[["ip", "app", "channel", "hour"]].groupby(by=["ip", "app", "channel"])[["hour"]].mean().reset_index().rename(index=str, columns={"hour": "ip_app_channel_mean_hour"})
-    merged_df = merged_df.merge(temp_df, on=["ip", "app", "channel"], how="left")
-    temp_df = None
-    release_resources()
+    return train_df, valid_df, test_df, submission_df
+
+def read_chunks(file_path, nrows=SAMPLE_NUM, chunksize=CHUNK_SIZE):
+    if USE_COLUMNAR_CACHE and columnar_cache.is_cache_valid(file_path):
+        yield from columnar_cache.iterate_chunks(file_path, nrows, chunksize)
+        return
+
+    parse_dates = ["click_time"]
+    dtype = {"ip": "uint32", "app": "uint16", "device": "uint16", "os": "uint16", "channel": "uint16", "is_attributed": "bool", "click_id": "uint32"}
+    for chunk_df in pd.read_csv(file_path, parse_dates=parse_dates, dtype=dtype, nrows=nrows, chunksize=chunksize):
+        chunk_df.drop("attributed_time", axis=1, inplace=True, errors="ignore")
+        chunk_df["day"] = chunk_df["click_time"].dt.day.astype("uint8")
+        chunk_df["hour"] = chunk_df["click_time"].dt.hour.astype("uint8")
+        chunk_df["timestamp"] = chunk_df["click_time"].values.astype("datetime64[s]").astype("int64").astype("uint32")
+        chunk_df.drop("click_time", axis=1, inplace=True)
+        yield chunk_df
+
+def load_data_in_chunks(nrows=SAMPLE_NUM):
+    # The click velocity features need the whole history of each key, so they are not supported in this mode
+    if ADD_VELOCITY_FEATURES:
+        raise ValueError("The click velocity features are not supported when CHUNK_MODE is enabled!")
+
+    print("Aggregating training data and testing data in chunks of {} rows ...".format(CHUNK_SIZE))
+    group_table_dict = group_features.initialize_group_tables()
+    category_count_dict = {}
+    file_path_to_row_num_dict = {}
+    for file_path in [TRAIN_FILE_PATH, TEST_FILE_PATH]:
+        file_path_to_row_num_dict[file_path] = 0
+        for chunk_df in read_chunks(file_path, nrows):
+            group_features.update_group_tables(group_table_dict, chunk_df)
+            if ENCODE_CATEGORICAL_FEATURES and file_path == TRAIN_FILE_PATH:
+                categorical_encoding.update_category_counts(category_count_dict, chunk_df)
+            file_path_to_row_num_dict[file_path] += len(chunk_df)
+            print("Aggregated {} rows of {} ...".format(file_path_to_row_num_dict[file_path], os.path.basename(file_path)))
+    group_feature_dict = group_features.finalize_group_tables(group_table_dict)
+    train_num, test_num = file_path_to_row_num_dict[TRAIN_FILE_PATH], file_path_to_row_num_dict[TEST_FILE_PATH]
+
+    encoder_dict = {}
+    if ENCODE_CATEGORICAL_FEATURES:
+        # The encoders are fitted on the counts of the training file, and each chunk is encoded before it is written
+        print("Fitting categorical encoders ...")
+        encoder_dict = {column_name: categorical_encoding.fit_encoder_from_counts(count_array) for column_name, count_array in category_count_dict.items()}
+        os.makedirs(MODEL_FOLDER_PATH, exist_ok=True)
+        categorical_encoding.save_encoders(encoder_dict, ENCODER_FILE_PATH)
+    category_count_dict = None
 
     print("Splitting data ...")
     train_indexes, valid_indexes = train_test_split(np.arange(train_num), test_size=0.1, random_state=0)
-    train_df, valid_df = merged_df.iloc[train_indexes], merged_df.iloc[valid_indexes]
-    test_df = merged_df.iloc[train_num:].drop("is_attributed", axis=1)
-    merged_df = None
+    train_row_num = len(train_indexes)
+    is_valid_array = np.zeros(train_num, dtype=np.bool_)
+    is_valid_array[valid_indexes] = True
+
+    # The rows are written sequentially into the training, validation and testing parts of the matrix,
+    # so that each part is a contiguous slice, and LightGBM reads it without a copy
+    print("Writing features to {} ...".format(FEATURE_FOLDER_PATH))
+    os.makedirs(FEATURE_FOLDER_PATH, exist_ok=True)
+    feature_matrix, feature_name_list = None, None
+    label_array = np.lib.format.open_memmap(os.path.join(FEATURE_FOLDER_PATH, "is_attributed.npy"), mode="w+", dtype=np.float32, shape=(train_num,))
+    click_id_array = np.zeros(test_num, dtype=np.uint32)
+    part_row_index_list = [0, train_row_num, train_num]
+    for file_path in [TRAIN_FILE_PATH, TEST_FILE_PATH]:
+        file_row_index = 0
+        for chunk_df in read_chunks(file_path, nrows):
+            group_features.lookup_group_features(group_table_dict, group_feature_dict, chunk_df)
+            categorical_encoding.transform(chunk_df, encoder_dict)
+            if feature_matrix is None:
+                feature_name_list = [column_name for column_name in chunk_df.columns if column_name not in ["is_attributed", "click_id", click_velocity.TIMESTAMP_COLUMN_NAME]]
+                feature_matrix = np.lib.format.open_memmap(os.path.join(FEATURE_FOLDER_PATH, "feature_matrix.npy"), mode="w+",
+                                                           dtype=FEATURE_MATRIX_DTYPE, shape=(train_num + test_num, len(feature_name_list)))
+
+            # Part 0 holds the training rows, part 1 the validation rows and part 2 the testing rows
+            if file_path == TEST_FILE_PATH:
+                chunk_part_index_array = np.full(len(chunk_df), 2)
+            else:
+                chunk_part_index_array = is_valid_array[file_row_index:file_row_index + len(chunk_df)].astype(np.int64)
+            chunk_feature_array = chunk_df[feature_name_list].values.astype(FEATURE_MATRIX_DTYPE)
+            for part_index in np.unique(chunk_part_index_array):
+                part_mask_array = chunk_part_index_array == part_index
+                start_index = part_row_index_list[part_index]
+                end_index = start_index + np.count_nonzero(part_mask_array)
+                feature_matrix[start_index:end_index] = chunk_feature_array[part_mask_array]
+                if part_index == 2:
+                    click_id_array[start_index - train_num:end_index - train_num] = chunk_df["click_id"].values[part_mask_array]
+                else:
+                    label_array[start_index:end_index] = chunk_df["is_attributed"].values[part_mask_array]
+                part_row_index_list[part_index] = end_index
+            file_row_index += len(chunk_df)
+    group_table_dict, group_feature_dict, chunk_df, chunk_feature_array = None, None, None, None
     release_resources()
 
-    print("Getting summary of train_df, valid_df and test_df ...")
-    for current_df in [train_df, valid_df, test_df]:
-        current_df.info(verbose=False, memory_usage=True)
+    feature_matrix.flush()
+    label_array.flush()
 
-    return train_df, valid_df, test_df, submission_df
+    print("Generating LightGBM datasets from a {} feature matrix ...".format(feature_matrix.shape))
+    train_dataset = lgb.Dataset(feature_matrix[:train_row_num], label_array[:train_row_num], feature_name=feature_name_list,
+                                categorical_feature=categorical_encoding.CATEGORICAL_FEATURE_LIST)
+    valid_dataset = lgb.Dataset(feature_matrix[train_row_num:train_num], label_array[train_row_num:], feature_name=feature_name_list,
+                                categorical_feature=categorical_encoding.CATEGORICAL_FEATURE_LIST, reference=train_dataset)
+    submission_df = pd.DataFrame({"click_id": click_id_array})
+    return train_dataset, valid_dataset, feature_matrix[train_num:], submission_df
 
-def run():
-    print("Loading data ...")
-    train_df, valid_df, test_df, submission_df = load_data()
+def get_feature_set_fingerprint(data_df_list, target_name, categorical_feature):
+    # The whole content is hashed, since that is still much cheaper than the binning of LightGBM
+    hash_object = hashlib.sha1()
+    hash_object.update(json.dumps([lgb.__version__, target_name, categorical_feature]).encode("utf-8"))
+    for data_df in data_df_list:
+        hash_object.update(json.dumps([len(data_df), list(data_df.columns), [str(dtype) for dtype in data_df.dtypes]]).encode("utf-8"))
+        for column_name in data_df.columns:
+            # Object columns, e.g., the label after merging with the testing data, are hashed by value instead of by pointer
+            column_array = data_df[column_name].values
+            if column_array.dtype == object:
+                column_array = pd.util.hash_pandas_object(data_df[column_name], index=False).values
+            hash_object.update(np.ascontiguousarray(column_array).data)
+    return hash_object.hexdigest()
+
+def get_datasets(train_df, valid_df, target_name="is_attributed", categorical_feature=categorical_encoding.CATEGORICAL_FEATURE_LIST):
+    dataset_cache_folder_path = None
+    if USE_DATASET_CACHE:
+        dataset_cache_folder_path = os.path.join(DATASET_CACHE_FOLDER_PATH, get_feature_set_fingerprint([train_df, valid_df], target_name, categorical_feature))
+        if os.path.isdir(dataset_cache_folder_path):
+            print("Loading LightGBM datasets from {} ...".format(dataset_cache_folder_path))
+            train_dataset = lgb.Dataset(os.path.join(dataset_cache_folder_path, "train.bin"))
+            valid_dataset = lgb.Dataset(os.path.join(dataset_cache_folder_path, "valid.bin"), reference=train_dataset)
+            return train_dataset, valid_dataset
 
-    print("Generating LightGBM datasets ...")
-    target_name = "is_attributed"
-    categorical_feature = ["ip", "app", "device", "os", "channel"]
     train_dataset = lgb.Dataset(train_df.drop(target_name, axis=1), train_df[target_name], categorical_feature=categorical_feature)
-    train_df = None
-    release_resources()
     valid_dataset = lgb.Dataset(valid_df.drop(target_name, axis=1), valid_df[target_name], categorical_feature=categorical_feature, reference=train_dataset)
-    valid_df = None
-    release_resources()
+    if dataset_cache_folder_path is not None:
+        # The datasets are saved into a temporary folder which is renamed, so that an interrupted run is never picked up
+        print("Saving LightGBM datasets to {} ...".format(dataset_cache_folder_path))
+        temporary_folder_path = dataset_cache_folder_path + ".tmp"
+        shutil.rmtree(temporary_folder_path, ignore_errors=True)
+        os.makedirs(temporary_folder_path)
+        train_dataset.save_binary(os.path.join(temporary_folder_path, "train.bin"))
+        valid_dataset.save_binary(os.path.join(temporary_folder_path, "valid.bin"))
+        os.replace(temporary_folder_path, dataset_cache_folder_path)
+    return train_dataset, valid_dataset
+
+def run():
+    if CHUNK_MODE:
+        # The datasets are built straight from the memory-mapped feature matrix, so that no data frame holds all the rows
+        print("Loading data in chunks ...")
+        train_dataset, valid_dataset, test_data, submission_df = load_data_in_chunks()
+    else:
+        print("Loading data ...")
+        train_df, valid_df, test_data, submission_df = load_data()
+
+        if ENCODE_CATEGORICAL_FEATURES:
+            print("Re-encoding categorical features ...")
+            encoder_dict = categorical_encoding.fit_encoders(train_df)
+            os.makedirs(MODEL_FOLDER_PATH, exist_ok=True)
+            categorical_encoding.save_encoders(encoder_dict, ENCODER_FILE_PATH)
+            for current_df in [train_df, valid_df, test_data]:
+                categorical_encoding.transform(current_df, encoder_dict)
+            release_resources()
+
+        print("Generating LightGBM datasets ...")
+        train_dataset, valid_dataset = get_datasets(train_df, valid_df)
+        train_df, valid_df = None, None
+        release_resources()
 
     print("Performing the training procedure ...")
     best_params = {"learning_rate": 0.2, "subsample": 0.9, "colsample_bytree": 0.9, "objective": "binary", "metric": "auc", "is_unbalance": True}  # Use empirical parameters
     model = lgb.train(params=best_params, train_set=train_dataset, valid_sets=[valid_dataset],
                     num_boost_round=NUM_BOOST_ROUND, early_stopping_rounds=EARLY_STOPPING_ROUNDS, verbose_eval=VERBOSE_EVAL)
+    print("Saving model to {} ...".format(MODEL_FILE_PATH))
+    os.makedirs(MODEL_FOLDER_PATH, exist_ok=True)
+    model.save_model(MODEL_FILE_PATH, num_iteration=model.best_iteration)
 
     print("Performing the testing procedure ...")
-    prediction_array = model.predict(test_df, num_iteration=model.best_iteration)
+    prediction_array = model.predict(test_data, num_iteration=model.best_iteration)
     submission_df["is_attributed"] = prediction_array
     submission_file_path = os.path.join(SUBMISSION_FOLDER_PATH, "{} {}.csv".format(TEAM_NAME, str(datetime.datetime.now()).split(".")[0]).replace(" ", "_"))
-    print("Saving submission to {} ...".format(submission_file_path))
-    submission_df.to_csv(submission_file_path, float_format="%.6f", index=False)
-    compressed_submission_file_path = create_zip_archive(submission_file_path)
-    print("Saving compressed submission to {} ...".format(compressed_submission_file_path))
+    print("Saving compressed submission to {} ...".format(submission_file_path))
+    compressed_submission_file_path = submission_writer.write_submission(submission_df, submission_file_path, compression="zip")
+    print("Saved compressed submission to {}.".format(compressed_submission_file_path))
 
     print("All done!")
 
@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import time
+import contextlib
+
+# Add the shared Tabular Pipeline folder to the path
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "Tabular Pipeline"))
+from memory_status import reset_peak_rss, read_memory_status_in_MB  # @UnresolvedImport pylint: disable=import-error
+
+def get_data_frame_memory_usage_in_MB(data_df_list):
+    return sum(data_df.memory_usage(index=True, deep=False).sum() for data_df in data_df_list if data_df is not None) / 1024 ** 2
+
+class StageTimeline(object):
+    # Records the wall time, the RSS and the memory usage of the data frames of each stage
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.start_time = time.perf_counter()
+        self.stage_record_list = []
+
+    @contextlib.contextmanager
+    def stage(self, stage_name, get_data_df_list=lambda: []):
+        # The data frames are retrieved through a function, since a stage usually replaces them
+        if not self.enabled:
+            yield
+            return
+
+        is_peak_rss_reset = reset_peak_rss()
+        rss_before, _ = read_memory_status_in_MB()
+        data_frame_memory_usage_before = get_data_frame_memory_usage_in_MB(get_data_df_list())
+        start_time = time.perf_counter()
+        yield
+        end_time = time.perf_counter()
+        rss_after, peak_rss = read_memory_status_in_MB()
+        data_frame_memory_usage_after = get_data_frame_memory_usage_in_MB(get_data_df_list())
+        self.stage_record_list.append({"stage": stage_name, "start_time": start_time - self.start_time, "wall_time": end_time - start_time,
+                                       "rss_before_MB": rss_before, "rss_after_MB": rss_after, "peak_rss_MB": peak_rss,
+                                       "is_peak_rss_per_stage": is_peak_rss_reset,
+                                       "data_frame_memory_usage_before_MB": data_frame_memory_usage_before,
+                                       "data_frame_memory_usage_after_MB": data_frame_memory_usage_after})
+        print("Stage {} took {:.2f} seconds, RSS {:.1f} MB -> {:.1f} MB with peak {:.1f} MB.".format(stage_name, end_time - start_time, rss_before, rss_after, peak_rss))
+
+    def export_json(self, file_path):
+        with open(file_path, "w") as file_object:
+            json.dump(self.stage_record_list, file_object, indent=2)
+
+    def render_chart(self, file_path):
+        try:
+            import matplotlib
+            matplotlib.use("Agg")
+            import matplotlib.pyplot as plt
+        except ImportError:
+            print("Skipping the chart since matplotlib is not available ...")
+            return
+
+        stage_name_list = [stage_record["stage"] for stage_record in self.stage_record_list]
+        position_list = list(range(len(stage_name_list)))[::-1]
+        figure, (time_axis, memory_axis) = plt.subplots(1, 2, sharey=True, figsize=(16, 1 + 0.4 * len(stage_name_list)))
+        time_axis.barh(position_list, [stage_record["wall_time"] for stage_record in self.stage_record_list],
+                       left=[stage_record["start_time"] for stage_record in self.stage_record_list])
+        time_axis.set_yticks(position_list)
+        time_axis.set_yticklabels(stage_name_list)
+        time_axis.set_xlabel("Time (s)")
+        memory_axis.barh(position_list, [stage_record["peak_rss_MB"] for stage_record in self.stage_record_list], color="lightgray", label="Peak RSS")
+        memory_axis.barh(position_list, [stage_record["rss_after_MB"] for stage_record in self.stage_record_list], height=0.4, label="RSS after")
+        memory_axis.barh(position_list, [stage_record["data_frame_memory_usage_after_MB"] for stage_record in self.stage_record_list], height=0.2, label="Data frames after")
+        memory_axis.set_xlabel("Memory (MB)")
+        memory_axis.legend(loc="lower right")
+        figure.tight_layout()
+        figure.savefig(file_path)
+        plt.close(figure)
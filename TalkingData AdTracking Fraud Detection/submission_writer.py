@@ -0,0 +1,116 @@
+import os
+import gzip
+import queue
+import zipfile
+import threading
+import numpy as np
+
+# Writing procedure
+CHUNK_SIZE = 10 ** 6
+DECIMAL_NUM = 6
+QUEUE_SIZE = 4
+
+def get_digit_num(value_array):
+    # Zero has one digit, and the powers of ten are compared exactly instead of going through log10
+    power_array = 10 ** np.arange(1, 19, dtype=np.int64)
+    return np.searchsorted(power_array, value_array, side="right") + 1
+
+def get_digit_matrix(value_array, digit_num):
+    # Right-aligned ASCII digits of non-negative integers
+    digit_matrix = np.empty((len(value_array), digit_num), dtype=np.uint8)
+    remainder_array = value_array.copy()
+    for digit_index in range(digit_num - 1, -1, -1):
+        digit_matrix[:, digit_index] = remainder_array % 10 + ord("0")
+        remainder_array //= 10
+    return digit_matrix
+
+def get_constant_field(row_num, character):
+    return np.full((row_num, 1), ord(character), dtype=np.uint8), np.ones((row_num, 1), dtype=np.bool_)
+
+def get_integer_fields(value_array, is_negative_array):
+    # The sign and the leading positions are masked out when they are not needed
+    digit_num_array = get_digit_num(value_array)
+    digit_num = int(digit_num_array.max()) if len(value_array) > 0 else 1
+    sign_matrix, _ = get_constant_field(len(value_array), "-")
+    digit_matrix = get_digit_matrix(value_array, digit_num)
+    digit_mask = np.arange(digit_num)[np.newaxis, :] >= (digit_num - digit_num_array)[:, np.newaxis]
+    return [(sign_matrix, is_negative_array[:, np.newaxis]), (digit_matrix, digit_mask)]
+
+def format_chunk(column_array_list, decimal_num=DECIMAL_NUM):
+    # Every row is laid out in a fixed-width byte matrix, and the mask removes the padding in a single pass
+    row_num = len(column_array_list[0])
+    field_list = []
+    for column_index, column_array in enumerate(column_array_list):
+        if column_index > 0:
+            field_list.append(get_constant_field(row_num, ","))
+        if column_array.dtype.kind == "f":
+            assert np.all(np.isfinite(column_array)), "Only finite values are supported!"
+            scaled_array = np.rint(np.abs(column_array.astype(np.float64)) * 10 ** decimal_num).astype(np.int64)
+            integer_part_array, fractional_part_array = np.divmod(scaled_array, 10 ** decimal_num)
+            field_list += get_integer_fields(integer_part_array, np.signbit(column_array))
+            if decimal_num > 0:
+                field_list.append(get_constant_field(row_num, "."))
+                field_list.append((get_digit_matrix(fractional_part_array, decimal_num), np.ones((row_num, decimal_num), dtype=np.bool_)))
+        else:
+            column_array = column_array.astype(np.int64)
+            field_list += get_integer_fields(np.abs(column_array), column_array < 0)
+    field_list.append(get_constant_field(row_num, "\n"))
+    line_matrix = np.hstack([field_matrix for field_matrix, _ in field_list])
+    line_mask = np.hstack([field_mask for _, field_mask in field_list])
+    return line_matrix[line_mask].tobytes()
+
+def iterate_formatted_chunks(data_df, chunk_size=CHUNK_SIZE, decimal_num=DECIMAL_NUM):
+    yield (",".join(data_df.columns) + "\n").encode("utf-8")
+    column_array_list = [data_df[column_name].values for column_name in data_df.columns]
+    for start_index in range(0, len(data_df), chunk_size):
+        yield format_chunk([column_array[start_index:start_index + chunk_size] for column_array in column_array_list], decimal_num)
+
+def iterate_in_thread(chunk_iterator, queue_size=QUEUE_SIZE):
+    # The chunks are formatted in a separate thread, so that formatting overlaps with compression and disk writes
+    chunk_queue = queue.Queue(maxsize=queue_size)
+    end_of_queue = object()
+
+    def produce_chunks():
+        try:
+            for chunk in chunk_iterator:
+                chunk_queue.put(chunk)
+        except Exception as exception:  # pylint: disable=broad-except
+            chunk_queue.put(exception)
+        finally:
+            chunk_queue.put(end_of_queue)
+
+    thread = threading.Thread(target=produce_chunks, daemon=True)
+    thread.start()
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is end_of_queue:
+            break
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+    thread.join()
+
+def write_submission(data_df, file_path, compression="zip", chunk_size=CHUNK_SIZE, decimal_num=DECIMAL_NUM, use_thread=True):
+    # The CSV content is streamed into the archive directly, so the file is never written and read back
+    chunk_iterator = iterate_formatted_chunks(data_df, chunk_size, decimal_num)
+    if use_thread:
+        chunk_iterator = iterate_in_thread(chunk_iterator)
+
+    if compression == "zip":
+        output_file_path = file_path[:file_path.rindex(".")] + ".zip"
+        with zipfile.ZipFile(output_file_path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file_object:
+            with zip_file_object.open(os.path.basename(file_path), "w", force_zip64=True) as file_object:
+                for chunk in chunk_iterator:
+                    file_object.write(chunk)
+    elif compression == "gzip":
+        output_file_path = file_path + ".gz"
+        with gzip.open(output_file_path, "wb") as file_object:
+            for chunk in chunk_iterator:
+                file_object.write(chunk)
+    else:
+        assert compression is None, "Unknown compression {}!".format(compression)
+        output_file_path = file_path
+        with open(output_file_path, "wb") as file_object:
+            for chunk in chunk_iterator:
+                file_object.write(chunk)
+    return output_file_path